@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class MrpSystemConfig(AppConfig):
     name = 'mrp_system'
+
+    def ready(self):
+        import mrp_system.signals
@@ -0,0 +1,60 @@
+import json, re
+from django.contrib.postgres.fields.jsonb import KeyTextTransform
+from django.db import connection
+from django.db.models import Q, TextField
+from django.db.models.expressions import RawSQL
+from mrp_system.models import Part
+
+"""a type's parameters are kept in Part.attributes as {Field.fields: value},
+the keys are named like the char1..char35 columns they replaced. Blank values
+aren't stored. Filters use jsonb containment (@>) so the GIN index on
+attributes is used"""
+
+#longest value the part form and imports accept, same as the old columns
+ATTRIBUTE_MAX_LENGTH = 100
+
+def field_key(number):
+    return 'char%d' % number
+
+def field_key_number(key):
+    #1 for 'char1', 0 for anything else
+    match = re.match(r'^char(\d+)$', key or '')
+    return int(match.group(1)) if match else 0
+
+def next_field_keys(keys, count):
+    #count unused keys following the highest of keys
+    start = max([field_key_number(key) for key in keys] + [0]) + 1
+    return [field_key(number) for number in range(start, start + count)]
+
+def attribute_filter(key, values):
+    """Q for parts whose key attribute is one of values, a blank value
+    matches parts that don't have the attribute"""
+    query = Q(pk__in=[])
+    for value in values:
+        if value:
+            query |= Q(attributes__contains={key: value})
+        else:
+            query |= ~Q(attributes__has_key=key)
+    return query
+
+def attribute_condition(key, values, table='part'):
+    #sql and params for attribute_filter() in a raw query where Part is table
+    sql = []
+    params = []
+    for value in values:
+        if value:
+            sql.append('%s.attributes @> %%s::jsonb' % table)
+            params.append(json.dumps({key: value}))
+        else:
+            sql.append('NOT %s.attributes ? %%s' % table)
+            params.append(key)
+    return '(%s)' % (' OR '.join(sql) or 'FALSE'), params
+
+def attribute_value(key):
+    #a part's key attribute as text (null when blank) for annotate()/values()
+    return KeyTextTransform(key, 'attributes')
+
+def attribute_text():
+    #every attribute value of the part joined into one string, for its search vector
+    return RawSQL("(SELECT string_agg(value, ' ') FROM jsonb_each_text(%s.attributes))"
+                  % connection.ops.quote_name(Part._meta.db_table), [], output_field=TextField())
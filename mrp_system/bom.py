@@ -0,0 +1,182 @@
+from collections import defaultdict
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Prefetch
+from mrp_system.models import (Part, Product, ProductAmount, PartAmount, ProductLocation,
+                               part_prefetches)
+
+#flattened BOMs are also cleared by signals whenever a PartAmount/ProductAmount changes
+BOM_CACHE_TIMEOUT = 60 * 60 * 24
+
+#walks every ProductAmount row reachable from the root products in one query,
+#UNION (not UNION ALL) drops rows already visited so cycles can't loop forever
+BOM_EDGES_SQL = """
+WITH RECURSIVE bom(id, from_product_id, to_product_id, amount) AS (
+    SELECT id, from_product_id, to_product_id, amount
+    FROM {table} WHERE from_product_id = ANY(%s)
+    UNION
+    SELECT pa.id, pa.from_product_id, pa.to_product_id, pa.amount
+    FROM {table} pa INNER JOIN bom ON pa.from_product_id = bom.to_product_id
+)
+SELECT from_product_id, to_product_id, amount FROM bom
+"""
+
+#every product that uses one of the given products somewhere in its BOM
+BOM_PARENTS_SQL = """
+WITH RECURSIVE parents(id) AS (
+    SELECT from_product_id FROM {table} WHERE to_product_id = ANY(%s)
+    UNION
+    SELECT pa.from_product_id FROM {table} pa INNER JOIN parents ON pa.to_product_id = parents.id
+)
+SELECT id FROM parents
+"""
+
+class BOMCycleError(Exception):
+    def __init__(self, product):
+        self.product = product
+        super(BOMCycleError, self).__init__(
+            '%s is used as a sub product of itself.' % product)
+
+def bom_cache_key(product_id):
+    return 'bom:%d' % product_id
+
+def product_queryset():
+    #stock locations are shown next to sub products
+    return Product.objects.prefetch_related(
+        Prefetch('productlocation_set', queryset=ProductLocation.objects.select_related('location')))
+
+class BOMGraph(object):
+    """holds the whole product/sub product/part graph below a set of root
+    products, loaded with a fixed number of queries however deep the BOM is"""
+
+    def __init__(self, product_ids):
+        product_ids = list(set(product_ids))
+        #sub products of each product as (to_product_id, amount)
+        self.children = defaultdict(list)
+        #parts of each product as (part_id, amount)
+        self.parts = defaultdict(list)
+        self.part_objects = {}
+        #flattened (parts, products) of each product exploded so far
+        self.rollups = {}
+        self._visiting = set()
+        with connection.cursor() as cursor:
+            cursor.execute(BOM_EDGES_SQL.format(table=ProductAmount._meta.db_table),
+                           [product_ids])
+            for from_id, to_id, amount in cursor.fetchall():
+                self.children[from_id].append((to_id, amount or 0))
+        all_ids = set(product_ids)
+        for edges in self.children.values():
+            all_ids.update(to_id for to_id, amount in edges)
+        self.products = product_queryset().in_bulk(all_ids)
+        #locations and manufacturers are prefetched so BOM pages and exports don't query per part
+        part_amounts = (PartAmount.objects.filter(product_id__in=all_ids)
+                        .select_related('part')
+                        .prefetch_related(*part_prefetches('part__')))
+        for pa in part_amounts:
+            self.parts[pa.product_id].append((pa.part_id, pa.amount or 0))
+            self.part_objects[pa.part_id] = pa.part
+
+    def rollup(self, product_id):
+        """flattened ({part_id: amount}, {sub product_id: amount}) needed for one
+        of product_id, each sub product is only exploded once however many
+        products it's used in"""
+        if product_id in self.rollups:
+            return self.rollups[product_id]
+        if product_id in self._visiting:
+            raise BOMCycleError(self.products[product_id])
+        self._visiting.add(product_id)
+        parts = {}
+        products = {}
+        for part_id, amount in self.parts[product_id]:
+            parts[part_id] = parts.get(part_id, 0) + amount
+        for to_id, amount in self.children[product_id]:
+            products[to_id] = products.get(to_id, 0) + amount
+            sub_parts, sub_products = self.rollup(to_id)
+            #multiplier needed to get total amount(amount * number of products)
+            for part_id, sub_amount in sub_parts.items():
+                parts[part_id] = parts.get(part_id, 0) + sub_amount * amount
+            for sub_id, sub_amount in sub_products.items():
+                products[sub_id] = products.get(sub_id, 0) + sub_amount * amount
+        self._visiting.discard(product_id)
+        self.rollups[product_id] = (parts, products)
+        return self.rollups[product_id]
+
+    def topological_order(self, product_ids):
+        #every product below product_ids ordered so a product always comes before its sub products
+        incoming = defaultdict(int)
+        reachable = set()
+        stack = list(product_ids)
+        while stack:
+            product_id = stack.pop()
+            if product_id in reachable:
+                continue
+            reachable.add(product_id)
+            for to_id, amount in self.children[product_id]:
+                incoming[to_id] += 1
+                stack.append(to_id)
+        order = []
+        ready = [product_id for product_id in reachable if not incoming[product_id]]
+        while ready:
+            product_id = ready.pop()
+            order.append(product_id)
+            for to_id, amount in self.children[product_id]:
+                incoming[to_id] -= 1
+                if not incoming[to_id]:
+                    ready.append(to_id)
+        #anything left over is part of a cycle
+        if len(order) != len(reachable):
+            product_id = next(p for p in reachable if incoming[p])
+            raise BOMCycleError(self.products[product_id])
+        return order
+
+def get_rollups(product_ids):
+    #flattened BOM of each product, from the cache where possible
+    keys = {bom_cache_key(product_id): product_id for product_id in set(product_ids)}
+    cached = cache.get_many(keys.keys())
+    rollups = {keys[key]: value for key, value in cached.items()}
+    missing = [product_id for product_id in keys.values() if product_id not in rollups]
+    if missing:
+        graph = BOMGraph(missing)
+        for product_id in missing:
+            rollups[product_id] = graph.rollup(product_id)
+        #cache every sub product exploded along the way, not just the roots
+        cache.set_many({bom_cache_key(product_id): value for product_id, value
+                        in graph.rollups.items()}, BOM_CACHE_TIMEOUT)
+    return rollups
+
+def explode_products(quantities):
+    """flatten {product: amount} into ({part: total}, {sub product: total}),
+    quantities is a dictionary of product and how many of that product are needed"""
+    rollups = get_rollups([product.id for product in quantities])
+    part_totals = {}
+    product_totals = {}
+    for product, amount in quantities.items():
+        sub_parts, sub_products = rollups[product.id]
+        for part_id, sub_amount in sub_parts.items():
+            part_totals[part_id] = part_totals.get(part_id, 0) + sub_amount * (amount or 0)
+        for sub_id, sub_amount in sub_products.items():
+            product_totals[sub_id] = product_totals.get(sub_id, 0) + sub_amount * (amount or 0)
+    part_objects = (Part.objects.filter(id__in=part_totals)
+                    .prefetch_related(*part_prefetches())
+                    .in_bulk())
+    product_objects = product_queryset().in_bulk(product_totals.keys())
+    parts = {part_objects[part_id]: amount for part_id, amount in part_totals.items()}
+    products = {product_objects[product_id]: amount for product_id, amount
+                in product_totals.items()}
+    return parts, products
+
+def get_descendant_ids(product_ids):
+    #ids of every product used somewhere below the given products
+    with connection.cursor() as cursor:
+        cursor.execute(BOM_EDGES_SQL.format(table=ProductAmount._meta.db_table),
+                       [list(product_ids)])
+        return set(to_id for from_id, to_id, amount in cursor.fetchall())
+
+def invalidate_bom(product_id):
+    #a product's BOM changed, so did the BOM of every product that uses it
+    with connection.cursor() as cursor:
+        cursor.execute(BOM_PARENTS_SQL.format(table=ProductAmount._meta.db_table),
+                       [[product_id]])
+        product_ids = set(row[0] for row in cursor.fetchall())
+    product_ids.add(product_id)
+    cache.delete_many([bom_cache_key(p) for p in product_ids])
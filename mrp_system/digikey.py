@@ -0,0 +1,259 @@
+import datetime, hashlib, threading, time
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.exceptions import NewConnectionError
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from mrp_system.models import DigiKeyAPI
+
+CLIENT_ID = '73432ca9-e8ba-4965-af17-a22107f63b35'
+CLIENT_SECRET = 'G2rQ1cM8yM4gV6rW2nA1wL2yF7dN4sX4fJ2lV6jE5uT0bB0uG8'
+#both can be pointed at a local fake server in settings
+TOKEN_URL = getattr(settings, 'DIGIKEY_TOKEN_URL', 'https://sso.digikey.com/as/token.oauth2')
+API_URL = getattr(settings, 'DIGIKEY_API_URL', 'https://api.digikey.com')
+
+#(connect, read) seconds for api calls, datasheets come from slower vendor sites
+TIMEOUT = (5, 30)
+DOWNLOAD_TIMEOUT = 5
+#a request that can't connect, times out or gets one of these statuses is tried
+#again after 0.5, 1, 2... seconds (or the Retry-After the server sends)
+RETRIES = 3
+RETRY_BACKOFF = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+#connections kept open per host, one per thread looking parts up at once
+POOL_SIZE = 10
+#tokens are refreshed this long before digikey says they expire
+TOKEN_MARGIN = datetime.timedelta(minutes=1)
+
+#parts found by a barcode or keyword lookup are kept this long so entering or
+#checking the same part again doesn't use up the api quota
+LOOKUP_CACHE_TIMEOUT = getattr(settings, 'DIGIKEY_CACHE_TIMEOUT', 60 * 60 * 24)
+LOOKUP_STATS_KEYS = {'hits': 'digikey:hits', 'misses': 'digikey:misses'}
+
+#the search options and filters digikey's keyword search was set up with
+KEYWORD_SEARCH = {
+    "SearchOptions": ["ManufacturerPartSearch"],
+    "RecordCount": "10",
+    "RecordStartPosition": "0",
+    "Filters": {"CategoryIds": [27442628], "FamilyIds": [81316194],
+                "ManufacturerIds": [88520800],
+                "ParametricFilters": [{"ParameterId": "725", "ValueId": "7"}]},
+    "Sort": {"Option": "SortByUnitPrice", "Direction": "Ascending", "SortParameterId": "50"},
+    "RequestedQuantity": "50",
+}
+
+DOWNLOAD_HEADERS = {'User-Agent': 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:35.0) Gecko/20100101 Firefox/35.0'}
+
+class DigiKeyError(Exception):
+    pass
+
+class DigiKeyTokenError(DigiKeyError):
+    def __init__(self):
+        super(DigiKeyTokenError, self).__init__('Digi-Key access tokens are off.')
+
+def make_session(adapter=None):
+    """a session that keeps connections open between lookups, adapter can be
+    swapped for one that talks to a fake server"""
+    session = requests.Session()
+    adapter = adapter or HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def retry_delay(response, attempt):
+    try:
+        return float(response.headers['Retry-After'])
+    except (AttributeError, KeyError, ValueError):
+        return RETRY_BACKOFF * 2 ** attempt
+
+def connect_failed(error):
+    #True when the request couldn't even connect, so nothing reached the server
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return (isinstance(error, requests.ConnectionError) and
+            isinstance(reason, NewConnectionError))
+
+def exact_part(results):
+    #the part a keyword search matched exactly, or None
+    for part in [results.get('ExactDigiKeyPart')] + list(results.get('ExactParts') or [])[:1]:
+        if part and part.get('Parameters') is not None:
+            return part
+    return None
+
+def normalize_search(search):
+    #part numbers are looked up the same however they were typed
+    return ' '.join(str(search).split()).upper()
+
+def lookup_cache_key(endpoint, search):
+    return 'digikey:%s:%s' % (endpoint, hashlib.md5(normalize_search(search).encode()).hexdigest())
+
+def count_lookup(stat):
+    key = LOOKUP_STATS_KEYS[stat]
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        #evicted between add and incr
+        pass
+
+def lookup_cache_stats():
+    #{'hits': n, 'misses': n} of the lookup cache since the counters were last cleared
+    values = cache.get_many(LOOKUP_STATS_KEYS.values())
+    return {stat: values.get(key, 0) for stat, key in LOOKUP_STATS_KEYS.items()}
+
+def cached_lookup(endpoint, search, lookup):
+    """result of lookup() for a search, from the cache if it was looked up
+    within LOOKUP_CACHE_TIMEOUT. Only found results are kept, None isn't"""
+    key = lookup_cache_key(endpoint, search)
+    result = cache.get(key)
+    if result is not None:
+        count_lookup('hits')
+        return result
+    count_lookup('misses')
+    result = lookup()
+    if result is not None:
+        cache.set(key, result, LOOKUP_CACHE_TIMEOUT)
+    return result
+
+class DigiKeyClient(object):
+    """talks to the digikey api over one pooled session. The access token is
+    kept in the DigiKeyAPI row until it expires instead of being refreshed for
+    every lookup. Safe to share between threads"""
+
+    def __init__(self, session=None, api_url=API_URL, token_url=TOKEN_URL,
+                 timeout=TIMEOUT, retries=RETRIES, use_cache=True):
+        self.session = session or make_session()
+        self.use_cache = use_cache
+        self.api_url = api_url.rstrip('/')
+        self.token_url = token_url
+        self.timeout = timeout
+        self.retries = retries
+
+    def send(self, method, url, **kwargs):
+        #one request, tried again with backoff if digikey can't be reached or is busy
+        kwargs.setdefault('timeout', self.timeout)
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.retries:
+                    raise DigiKeyError('Couldn\'t reach %s: %s' % (url, e))
+                response = None
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                    return response
+            time.sleep(retry_delay(response, attempt))
+
+    def access_token(self, rejected=None):
+        """current access token, refreshed with the refresh token only when it
+        has expired or digikey turned down the rejected token"""
+        def usable(digi):
+            return (digi.access_token and digi.expires and
+                    digi.expires > timezone.now() and digi.access_token != rejected)
+        digi = DigiKeyAPI.objects.get(name="DigiKey")
+        if usable(digi):
+            return digi.access_token
+        #the row is locked so only one thread or process refreshes, digikey
+        #replaces the refresh token every time it's used. The lock is let go
+        #while waiting to try again
+        for attempt in range(self.retries + 1):
+            with transaction.atomic():
+                digi = DigiKeyAPI.objects.select_for_update().get(name="DigiKey")
+                if usable(digi):
+                    return digi.access_token
+                try:
+                    response = self.refresh_tokens(digi.refresh_token)
+                except requests.RequestException as e:
+                    if not connect_failed(e) or attempt == self.retries:
+                        raise DigiKeyError('Couldn\'t reach %s: %s' % (self.token_url, e))
+                else:
+                    self.save_tokens(digi, response)
+                    return digi.access_token
+            time.sleep(retry_delay(None, attempt))
+
+    def refresh_tokens(self, refresh_token):
+        """one request for new tokens, never sent again: once digikey has seen
+        the refresh token it's used up, even if the answer doesn't arrive"""
+        return self.session.post(self.token_url, timeout=self.timeout, data={
+            'client_id': CLIENT_ID,
+            'client_secret': CLIENT_SECRET,
+            'refresh_token': refresh_token,
+            'grant_type': 'refresh_token'})
+
+    def save_tokens(self, digi, response):
+        try:
+            tokens = response.json()
+            digi.refresh_token = tokens['refresh_token']
+            digi.access_token = tokens['access_token']
+            expires_in = datetime.timedelta(seconds=int(tokens.get('expires_in') or 0))
+        except (ValueError, KeyError, TypeError):
+            raise DigiKeyTokenError()
+        digi.expires = timezone.now() + expires_in - TOKEN_MARGIN
+        digi.save()
+
+    def api(self, method, path, **kwargs):
+        """json from an api call, the token is refreshed and the call made again
+        once if digikey says the token isn't valid"""
+        headers = {'x-ibm-client-id': CLIENT_ID,
+                   'x-digikey-locale-site': "US",
+                   'x-digikey-locale-language': "en",
+                   'x-digikey-locale-currency': "USD",
+                   'accept': "application/json"}
+        headers.update(kwargs.pop('headers', {}))
+        token = self.access_token()
+        response = self.send(method, self.api_url + path, headers=dict(headers, authorization=token), **kwargs)
+        if response.status_code == 401:
+            token = self.access_token(rejected=token)
+            response = self.send(method, self.api_url + path, headers=dict(headers, authorization=token), **kwargs)
+            if response.status_code == 401:
+                raise DigiKeyTokenError()
+        if response.status_code in RETRY_STATUSES:
+            raise DigiKeyError('Digi-Key is busy or down (%d), try again later.' % response.status_code)
+        try:
+            return response.json()
+        except ValueError:
+            raise DigiKeyError('Digi-Key returned %d: %s' % (response.status_code, response.text[:200]))
+
+    def barcode_part_number(self, barcode):
+        #digikey part number of a digikey barcode, or None
+        def lookup():
+            result = self.api('GET', '/services/barcode/v1/productbarcode/' + barcode)
+            return result.get('DigiKeyPartNumber') if isinstance(result, dict) else None
+        if not self.use_cache:
+            return lookup()
+        return cached_lookup('barcode', barcode, lookup)
+
+    def keyword_search(self, keywords):
+        payload = dict(KEYWORD_SEARCH, Keywords=keywords)
+        return self.api('POST', '/services/partsearch/v2/keywordsearch', json=payload)
+
+    def find_part(self, keywords):
+        #the part matching a digikey or manufacturer part number exactly, or None
+        def lookup():
+            results = self.keyword_search(keywords)
+            return exact_part(results) if isinstance(results, dict) else None
+        if not self.use_cache:
+            return lookup()
+        return cached_lookup('keyword', keywords, lookup)
+
+    def download(self, url):
+        """content of a file (datasheet), or None if the site doesn't have it.
+        Raises DigiKeyError if the site can't be reached or keeps failing"""
+        response = self.send('GET', url, headers=DOWNLOAD_HEADERS, timeout=DOWNLOAD_TIMEOUT)
+        if response.status_code in RETRY_STATUSES:
+            raise DigiKeyError('%s returned %d' % (url, response.status_code))
+        return response.content if response.status_code == 200 else None
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    #the client shared by every request in this process, so its connections and token are reused
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = DigiKeyClient()
+        return _client
@@ -0,0 +1,190 @@
+import difflib, re
+from collections import defaultdict
+from django.db import transaction
+from django.db.models import Count, Q
+from mrp_system.models import (Vendor, Location, Part, ManufacturerRelationship,
+                               DuplicateCandidate)
+from mrp_system.merge import merge_objects
+
+KIND_MODELS = {'vendor': Vendor, 'location': Location, 'part': Part}
+
+#pairs scoring lower than this aren't suggested
+MIN_SCORE = 0.85
+#names are only compared with names sharing the first letters of the whole
+#name or of its longest word, so it's never every name against every other
+BLOCK_KEY_LENGTH = 4
+#a key shared by this many names is too generic to narrow anything down
+MAX_BLOCK_SIZE = 500
+
+#open candidates shown on the review page at once, best scores first
+DUPLICATES_PAGE_SIZE = 200
+
+#words dropped from names before comparing them
+NAME_STOP_WORDS = {'the', 'and', 'inc', 'incorporated', 'corp', 'corporation', 'co',
+                   'company', 'ltd', 'limited', 'llc', 'gmbh', 'ag', 'sa', 'plc'}
+
+def normalize_name(name):
+    #"Texas Instruments, Inc." -> "texas instruments"
+    words = re.findall(r'[a-z0-9]+', name.lower().replace('&', ' and '))
+    return ' '.join(word for word in words if word not in NAME_STOP_WORDS)
+
+def normalize_part_number(number):
+    #"LM317-T/R" -> "LM317TR"
+    return re.sub(r'[^A-Z0-9]', '', number.upper())
+
+def block_keys(normalized):
+    longest = max(normalized.split(), key=len)
+    return {normalized[:BLOCK_KEY_LENGTH], longest[:BLOCK_KEY_LENGTH]}
+
+def name_similarity(first, second):
+    #(score from 0 to 1, reason) for two normalized names
+    if first == second:
+        return 1.0, 'same name'
+    first_words = set(first.split())
+    second_words = set(second.split())
+    ratio = difflib.SequenceMatcher(None, first, second).ratio()
+    if first_words <= second_words or second_words <= first_words:
+        return max(ratio, 0.9), 'one name contains the other'
+    return ratio, 'similar names'
+
+def name_candidates(objects):
+    """[(id, id, score, reason)] for (id, name) pairs whose names look alike,
+    only names sharing a block key are compared"""
+    names = {}
+    blocks = defaultdict(list)
+    for object_id, name in objects:
+        normalized = normalize_name(name)
+        if normalized:
+            names[object_id] = normalized
+            for key in block_keys(normalized):
+                blocks[key].append(object_id)
+    scores = {}
+    for ids in blocks.values():
+        if len(ids) > MAX_BLOCK_SIZE:
+            continue
+        for index, first in enumerate(ids):
+            for second in ids[index + 1:]:
+                pair = (min(first, second), max(first, second))
+                if pair not in scores:
+                    scores[pair] = name_similarity(names[first], names[second])
+    return [(first, second, score, reason) for (first, second), (score, reason)
+            in scores.items() if score >= MIN_SCORE]
+
+def keep_most_used(candidates, usage):
+    #order each pair so the one with the most parts is kept
+    return [(first, second, score, reason) if usage[first] >= usage[second]
+            else (second, first, score, reason)
+            for first, second, score, reason in candidates]
+
+def mergeable(kind):
+    #objects of a kind that can be merged, vendors only when they're manufacturers
+    objects = KIND_MODELS[kind].objects.all()
+    return objects.filter(vendor_type='manufacturer') if kind == 'vendor' else objects
+
+def vendor_candidates():
+    vendors = list(mergeable('vendor').annotate(count=Count('part')).values_list('id', 'name', 'count'))
+    usage = {vendor_id: count for vendor_id, name, count in vendors}
+    return keep_most_used(name_candidates((vendor_id, name) for vendor_id, name, count in vendors),
+                          usage)
+
+def location_candidates():
+    locations = list(Location.objects.annotate(count=Count('part')).values_list('id', 'name', 'count'))
+    usage = {location_id: count for location_id, name, count in locations}
+    return keep_most_used(name_candidates((location_id, name) for location_id, name, count in locations),
+                          usage)
+
+def part_candidates():
+    """parts with the same manufacturer part number once punctuation and case
+    are ignored, the part number is the block key. Scored lower when the
+    manufacturer names differ, the older part is kept"""
+    groups = defaultdict(list)
+    rows = (ManufacturerRelationship.objects.exclude(partNumber='')
+            .values_list('part_id', 'partNumber', 'manufacturer__name').iterator())
+    for part_id, number, manufacturer in rows:
+        key = normalize_part_number(number)
+        if key:
+            groups[key].append((part_id, number, normalize_name(manufacturer)))
+    scores = {}
+    for rows in groups.values():
+        if len(rows) > MAX_BLOCK_SIZE:
+            continue
+        for index, (first, first_number, first_manufacturer) in enumerate(rows):
+            for second, second_number, second_manufacturer in rows[index + 1:]:
+                if first == second:
+                    continue
+                manufacturer_score, reason = name_similarity(first_manufacturer, second_manufacturer)
+                score = 0.7 + 0.3 * manufacturer_score
+                if first_number.upper() != second_number.upper():
+                    score -= 0.05
+                pair = (min(first, second), max(first, second))
+                if score > scores.get(pair, (0, ''))[0]:
+                    scores[pair] = (score, 'part number %s, %s' % (first_number, reason.replace('name', 'manufacturer')))
+    return [(first, second, score, reason) for (first, second), (score, reason)
+            in scores.items() if score >= MIN_SCORE]
+
+FINDERS = {'vendor': vendor_candidates, 'location': location_candidates, 'part': part_candidates}
+
+def candidate_objects(candidates):
+    """[(candidate, primary, alias)] with the objects of each candidate loaded
+    with one query per kind, candidates whose objects are gone are left out"""
+    ids = defaultdict(set)
+    for candidate in candidates:
+        ids[candidate.kind].update([candidate.primary_id, candidate.alias_id])
+    objects = {}
+    for kind, kind_ids in ids.items():
+        queryset = KIND_MODELS[kind].objects.all()
+        if kind == 'part':
+            queryset = queryset.prefetch_related('manufacturerrelationship_set__manufacturer')
+        objects[kind] = queryset.in_bulk(kind_ids)
+    rows = []
+    for candidate in candidates:
+        primary = objects[candidate.kind].get(candidate.primary_id)
+        alias = objects[candidate.kind].get(candidate.alias_id)
+        if primary is not None and alias is not None:
+            rows.append((candidate, primary, alias))
+    return rows
+
+def save_candidates(kind, candidates):
+    """queue new candidates for review, pairs already suggested (or dismissed)
+    aren't suggested again. Returns how many were added"""
+    seen = set(frozenset(pair) for pair in DuplicateCandidate.objects.filter(kind=kind)
+               .values_list('primary_id', 'alias_id'))
+    new = [DuplicateCandidate(kind=kind, primary_id=primary_id, alias_id=alias_id,
+                              score=round(score, 3), reason=reason[:200])
+           for primary_id, alias_id, score, reason in candidates
+           if frozenset((primary_id, alias_id)) not in seen]
+    DuplicateCandidate.objects.bulk_create(new)
+    return len(new)
+
+def clear_stale_candidates(kind):
+    #open candidates for objects that were deleted, merged some other way or can't be merged now
+    ids = mergeable(kind).values('id')
+    return (DuplicateCandidate.objects.filter(kind=kind, status='open')
+            .exclude(primary_id__in=ids, alias_id__in=ids).delete())
+
+def find_duplicates(kinds=None):
+    #look for duplicates of each kind, returns {kind: new candidates}
+    found = {}
+    for kind in kinds or list(FINDERS):
+        clear_stale_candidates(kind)
+        found[kind] = save_candidates(kind, FINDERS[kind]())
+    return found
+
+def merge_candidate(candidate, swap=False):
+    """merge the candidate's alias into its primary (or the other way around
+    if swap), other open suggestions for the deleted one are dropped"""
+    model = KIND_MODELS[candidate.kind]
+    primary_id, alias_id = candidate.primary_id, candidate.alias_id
+    if swap:
+        primary_id, alias_id = alias_id, primary_id
+    objects = model.objects.in_bulk([primary_id, alias_id])
+    if len(objects) != 2:
+        raise model.DoesNotExist('One of the %ss was already deleted.' % model._meta.verbose_name)
+    if model is Vendor and any(vendor.vendor_type != 'manufacturer' for vendor in objects.values()):
+        raise ValueError('Vendors must be of manufacturer type to be merged.')
+    with transaction.atomic():
+        merge_objects(objects[primary_id], objects[alias_id])
+        candidate.status = 'merged'
+        candidate.save()
+        (DuplicateCandidate.objects.filter(kind=candidate.kind, status='open')
+         .filter(Q(primary_id=alias_id) | Q(alias_id=alias_id)).delete())
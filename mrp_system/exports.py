@@ -0,0 +1,104 @@
+import csv, tempfile
+import xlsxwriter
+from django.http import StreamingHttpResponse, FileResponse
+from mrp_system.models import (ManufacturerRelationship, LocationRelationship,
+                               PurchaseOrderParts)
+from mrp_system.search import related_text
+from mrp_system.attributes import attribute_value
+
+EXPORT_FORMATS = ['csv', 'xlsx']
+#rows fetched from the database at a time by a server side cursor
+EXPORT_CHUNK_SIZE = 2000
+
+class Echo(object):
+    #csv.writer writes each row here and gets the line back to stream it
+    def write(self, value):
+        return value
+
+def csv_response(filename, header, rows):
+    """stream rows as a csv download while they're read from the database,
+    nothing is built up in memory"""
+    writer = csv.writer(Echo())
+    lines = (writer.writerow(row) for row in _with_header(header, rows))
+    response = StreamingHttpResponse(lines, content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="%s.csv"' % filename
+    return response
+
+def xlsx_response(filename, header, rows):
+    """xlsxwriter's constant_memory mode flushes each row to disk once the next
+    one is started, the finished workbook is then streamed from the temp file"""
+    output = tempfile.TemporaryFile()
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+    worksheet = workbook.add_worksheet()
+    for row_number, row in enumerate(_with_header(header, rows)):
+        worksheet.write_row(row_number, 0, row)
+    workbook.close()
+    output.seek(0)
+    return FileResponse(output, as_attachment=True, filename='%s.xlsx' % filename,
+                        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+
+def _with_header(header, rows):
+    yield header
+    yield from rows
+
+def export_response(export_format, filename, header, rows):
+    if export_format == 'xlsx':
+        return xlsx_response(filename, header, rows)
+    return csv_response(filename, header, rows)
+
+def part_export(parts, fields):
+    """header and rows for a part queryset. fields are the type's Field rows, their
+    columns are named after them. Manufacturers and locations are joined
+    into each row by the same query so it can be read with iterator()"""
+    header = (['Engimusing Part Number', 'Description', 'Manufacturer',
+               'Manufacturer Part Number', 'Location', 'Stock'] +
+              [field.name for field in fields])
+    attributes = {'attribute_%d' % index: attribute_value(field.fields)
+                  for index, field in enumerate(fields)}
+    columns = (['engimusingPartNumber', 'description', 'manufacturers', 'part_numbers',
+                'locations', 'on_hand'] + ['attribute_%d' % index for index in range(len(fields))])
+    parts = (parts.order_by('engimusingPartNumber')
+             .annotate(**attributes)
+             .annotate(manufacturers=related_text(ManufacturerRelationship, 'manufacturer__name', ', '),
+                       part_numbers=related_text(ManufacturerRelationship, 'partNumber', ', '),
+                       locations=related_text(LocationRelationship, 'location__name', ', '))
+             .values_list(*columns).iterator(chunk_size=EXPORT_CHUNK_SIZE))
+    return header, parts
+
+def bom_export(parts):
+    #header and rows for the {part: quantity} of an exploded BOM, relationships are prefetched
+    header = ['Quantity', 'Engimusing Part Number', 'Manufacturer',
+              'Manufacturer Part Number', 'Description']
+    rows = ([quantity, part.engimusingPartNumber,
+             ', '.join(m.manufacturer.name for m in part.manufacturerrelationship_set.all()),
+             ', '.join(m.partNumber for m in part.manufacturerrelationship_set.all()),
+             part.description]
+            for part, quantity in sorted(parts.items(), key=lambda item: item[0].engimusingPartNumber))
+    return header, rows
+
+def mo_export(parts, products):
+    #header and rows for the planned requirements of a manufacturing order
+    header = ['Item', 'Number', 'Description', 'Quantity Needed', 'Quantity In Stock',
+              'Amount to Order or Make']
+    part_rows = (['Part', part.engimusingPartNumber, part.description,
+                  value.gross, value.on_hand, value.net]
+                 for part, value in sorted(parts.items(), key=lambda item: item[0].engimusingPartNumber))
+    product_rows = (['Product', product.engimusing_product_number, product.description,
+                     value.gross, value.on_hand, value.net]
+                    for product, value in products.items())
+    return header, (row for rows in (part_rows, product_rows) for row in rows)
+
+def purchase_order_export(purchase_orders):
+    #header and one row per line of the purchase orders, read with a single query
+    header = ['Purchase Order', 'Vendor', 'Received', 'Item', 'Engimusing Part Number',
+              'Description', 'Manufacturer Part Number', 'Quantity', 'Unit Price', 'Total']
+    lines = (PurchaseOrderParts.objects.filter(purchase_order__in=purchase_orders)
+             .order_by('purchase_order__number', 'item_number')
+             .annotate(part_numbers=related_text(ManufacturerRelationship, 'partNumber', ', ',
+                                                 'part_id'))
+             .values_list('purchase_order__number', 'purchase_order__vendor__name',
+                          'purchase_order__received', 'item_number',
+                          'part__engimusingPartNumber', 'part__description', 'part_numbers',
+                          'quantity', 'unit_price', 'total')
+             .iterator(chunk_size=EXPORT_CHUNK_SIZE))
+    return header, lines
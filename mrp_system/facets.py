@@ -0,0 +1,173 @@
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count, Min, Max
+from mrp_system.models import (Part, Location, Vendor, Type, LocationRelationship,
+                               ManufacturerRelationship, PartValue)
+from mrp_system.attributes import attribute_condition
+
+#facets are also cleared by signals whenever a part, its stock/manufacturers or the type's fields change
+FACET_CACHE_TIMEOUT = 60 * 60 * 24
+
+#filters on the part list that go through a relationship table, keyed by GET parameter,
+#the type's fields are filtered by their Field.fields key
+RELATED_FILTERS = {'location': LocationRelationship,
+                   'manufacturer': ManufacturerRelationship}
+
+"""one row per (field, value) over every tracked field of a type in a single
+scan of its parts. Each value row carries whether the part matches the filters
+of the other fields, so every field can leave its own filter out"""
+CHAR_FACETS_SQL = """
+SELECT facet.field, facet.value, COUNT(*)
+FROM {table} part
+CROSS JOIN LATERAL (VALUES {values}) AS facet(field, value, matches)
+WHERE {where} AND facet.matches
+GROUP BY facet.field, facet.value
+ORDER BY facet.field, facet.value
+"""
+
+RELATED_FACETS_SQL = """
+SELECT rel.{column}, COUNT(DISTINCT rel.part_id)
+FROM {related_table} rel INNER JOIN {table} part ON part.id = rel.part_id
+WHERE {where} AND {matches}
+GROUP BY rel.{column}
+"""
+
+TOTAL_SQL = "SELECT COUNT(*) FROM {table} part WHERE {where} AND {matches}"
+
+def facet_cache_key(type_id):
+    return 'facets:%s' % type_id
+
+def filter_condition(name, values):
+    #sql and params limiting part to the chosen values of one filter
+    if name in RELATED_FILTERS:
+        model = RELATED_FILTERS[name]
+        ids = [int(value) for value in values if str(value).isdigit()]
+        return ('EXISTS (SELECT 1 FROM %s rel WHERE rel.part_id = part.id AND rel.%s = ANY(%%s))'
+                % (model._meta.db_table, model._meta.get_field(name).column), [ids])
+    return attribute_condition(name, values)
+
+def range_condition(field_id, low=None, high=None, unit=''):
+    #sql and params limiting part to a range of a field's numeric values, see parametric.py
+    sql = ['v.part_id = part.id', 'v.field_id = %s']
+    params = [field_id]
+    for condition, value in (('v.value >= %s', low), ('v.value <= %s', high), ('v.unit = %s', unit)):
+        if value is not None and value != '':
+            sql.append(condition)
+            params.append(value)
+    return 'EXISTS (SELECT 1 FROM %s v WHERE %s)' % (PartValue._meta.db_table, ' AND '.join(sql)), params
+
+def filter_names(fields):
+    #GET parameters the part list of a type with fields (Field.fields keys) is filtered by
+    return list(RELATED_FILTERS) + list(fields)
+
+def get_filter_conditions(filters, fields):
+    #{filter name: (sql, params)} for every known filter that has values chosen
+    return {name: filter_condition(name, values) for name, values in filters.items()
+            if name in filter_names(fields) and values}
+
+def combine_conditions(conditions, exclude=None):
+    #every condition but exclude joined with AND
+    sql = []
+    params = []
+    for name, (condition, condition_params) in conditions.items():
+        if name != exclude:
+            sql.append(condition)
+            params += condition_params
+    return ' AND '.join(sql) or 'TRUE', params
+
+def type_condition(type_id, parts=None):
+    #parts of the type, further limited to the parts queryset (e.g. a search) if given
+    sql = 'part."partType_id" = %s'
+    params = [type_id]
+    if parts is not None:
+        subquery, subquery_params = parts.order_by().values('id').query.sql_with_params()
+        sql += ' AND part.id IN (%s)' % subquery
+        params += list(subquery_params)
+    return sql, params
+
+def char_facets(type_id, fields, conditions=None, parts=None):
+    """{field: [(value, number of parts)]} for the given fields (Field.fields keys)
+    of a type, each field counted with every condition except its own. Parts
+    without a value are counted under ''"""
+    conditions = conditions or {}
+    facets = {field: [] for field in fields}
+    if not fields:
+        return facets
+    values = []
+    params = []
+    for field in fields:
+        matches, matches_params = combine_conditions(conditions, field)
+        values.append("(%%s, COALESCE(part.attributes ->> %%s, ''), %s)" % matches)
+        params += [field, field] + matches_params
+    where, where_params = type_condition(type_id, parts)
+    with connection.cursor() as cursor:
+        cursor.execute(CHAR_FACETS_SQL.format(table=Part._meta.db_table, values=', '.join(values),
+                                              where=where), params + where_params)
+        for field, value, count in cursor.fetchall():
+            facets[field].append((value, count))
+    return facets
+
+def related_counts(name, type_id, conditions=None, parts=None):
+    #{location/manufacturer id: number of parts} counted with every condition except its own
+    conditions = conditions or {}
+    model = RELATED_FILTERS[name]
+    where, where_params = type_condition(type_id, parts)
+    matches, matches_params = combine_conditions(conditions, name)
+    with connection.cursor() as cursor:
+        cursor.execute(RELATED_FACETS_SQL.format(
+            column=model._meta.get_field(name).column, related_table=model._meta.db_table,
+            table=Part._meta.db_table, where=where, matches=matches),
+            where_params + matches_params)
+        return dict(cursor.fetchall())
+
+def related_facets(model, type_id):
+    #[(id, name, number of parts)] for the locations or manufacturers used by a type
+    return list(model.objects.filter(part__partType_id=type_id)
+                .annotate(count=Count('part', distinct=True))
+                .order_by('name').values_list('id', 'name', 'count'))
+
+def value_ranges(type_id):
+    #[(Field.fields key, lowest, highest, unit)] of the type's fields that have numeric values
+    return list(PartValue.objects.filter(field__typePart_id=type_id).values('field__fields')
+                .annotate(low=Min('value'), high=Max('value'), unit=Max('unit'))
+                .order_by('field__fields').values_list('field__fields', 'low', 'high', 'unit'))
+
+def get_type_facets(type_id, fields):
+    """distinct values and part counts of every tracked field, location and
+    manufacturer of a type, from the cache where possible"""
+    key = facet_cache_key(type_id)
+    facets = cache.get(key)
+    #tracked fields of the type may have changed since it was cached
+    if facets is None or set(facets['fields']) != set(fields):
+        facets = {'fields': char_facets(type_id, fields),
+                  'ranges': value_ranges(type_id),
+                  'location': related_facets(Location, type_id),
+                  'manufacturer': related_facets(Vendor, type_id)}
+        cache.set(key, facets, FACET_CACHE_TIMEOUT)
+    return facets
+
+def live_facets(type_id, fields, filters, parts=None, ranges=None):
+    """part counts for every value of the type's fields, locations and
+    manufacturers with the chosen filters applied, one query per group.
+    filters is {filter name: [values]}, ranges is {Field: (low, high, unit)}
+    and parts can limit it further (a search)"""
+    conditions = get_filter_conditions(filters, fields)
+    for field, value_range in (ranges or {}).items():
+        conditions[field.fields + '__range'] = range_condition(field.id, *value_range)
+    where, where_params = type_condition(type_id, parts)
+    matches, matches_params = combine_conditions(conditions)
+    with connection.cursor() as cursor:
+        cursor.execute(TOTAL_SQL.format(table=Part._meta.db_table, where=where, matches=matches),
+                       where_params + matches_params)
+        total = cursor.fetchone()[0]
+    return {'total': total,
+            'fields': {field: dict(values) for field, values
+                       in char_facets(type_id, fields, conditions, parts).items()},
+            'location': related_counts('location', type_id, conditions, parts),
+            'manufacturer': related_counts('manufacturer', type_id, conditions, parts)}
+
+def invalidate_facets(type_ids=None):
+    #clear the facets of the given types, or of every type
+    if type_ids is None:
+        type_ids = Type.objects.values_list('id', flat=True)
+    cache.delete_many([facet_cache_key(type_id) for type_id in type_ids])
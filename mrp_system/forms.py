@@ -3,10 +3,16 @@ from mrp_system.models import (Location, LocationRelationship,
 Part, Vendor, ManufacturerRelationship, Field, Type, Product,
                                PartAmount, ProductAmount, ProductLocation,
                                MOProduct, ManufacturingOrder, PurchaseOrder,
-                               PurchaseOrderParts)
+                               PurchaseOrderParts, IntakeBatch, IntakeItem)
 from django.forms import ModelForm, BaseInlineFormSet
 from django.forms.models import inlineformset_factory
 from timepiece.forms import TimepieceSplitDateTimeField
+from mrp_system.bom import get_descendant_ids
+from mrp_system.search import SEARCH_MODES
+from mrp_system.facets import get_type_facets
+from mrp_system.attributes import ATTRIBUTE_MAX_LENGTH, field_key, field_key_number
+from mrp_system.parametric import format_quantity
+from mrp_system.imports import file_problem
 from django.utils.safestring import mark_safe
 
 class PartForm(ModelForm): 
@@ -14,20 +20,22 @@ class PartForm(ModelForm):
         def __init__(self, type_id, *args, **kwargs):
             super(PartForm, self).__init__(*args, **kwargs)
             partType = Type.objects.get(id=type_id)
-            """take label from Type/Field models and assign it to the
-            correct field"""
-            for field in partType.field.all():
-                self.fields[field.fields].label = field.name
-            field_options = []
-            """generate a list of all possible fields"""
-            for x in range(1,36):
-                field_options.append('char' + str(x))
-            for field in field_options:
-                """if field hasn't been assigned to this type, don't include
-                it in the form"""
-                if field not in partType.field.values_list('fields', flat=True):
-                    self.fields.pop(field)
-            
+            """one text box for each of the type's fields, labelled with the
+            field's name, its value is kept in the part's attributes"""
+            self.attribute_keys = []
+            for field in partType.field.order_by('id'):
+                self.fields[field.fields] = forms.CharField(
+                    label=field.name, required=False, max_length=ATTRIBUTE_MAX_LENGTH,
+                    initial=self.instance.get_attribute(field.fields))
+                self.attribute_keys.append(field.fields)
+            self.order_fields(['description'] + self.attribute_keys)
+
+        def save(self, commit=True):
+            #values of fields the type no longer has are left alone
+            for key in self.attribute_keys:
+                self.instance.set_attribute(key, self.cleaned_data.get(key, ''))
+            return super(PartForm, self).save(commit)
+
         class Meta:
             model = Part
             exclude = ('manufacturer', 'location', 'partType')
@@ -106,7 +114,21 @@ class ProductForm(ModelForm):
             pass
         return self.cleaned_data
         
+def limit_part_choices(form):
+    """only render the selected part in the part dropdown, the rest are loaded by
+    the search typeahead. The field's queryset is untouched so any part validates"""
+    field = form.fields['part']
+    part_id = form['part'].value()
+    choices = [('', field.empty_label)]
+    if part_id:
+        choices += [(part.pk, str(part)) for part in Part.objects.filter(pk=part_id)]
+    field.widget.choices = choices
+
 class PartToProductForm(ModelForm):
+    def __init__(self, *args, **kwargs):
+        super(PartToProductForm, self).__init__(*args, **kwargs)
+        limit_part_choices(self)
+
     #used to narrow down part selection dropdown with javascript
     #mark_safe - lets you added html elements to text
     search = forms.CharField(required=False, help_text=mark_safe('(Can search part type,' +
@@ -126,9 +148,26 @@ class ProductToProductForm(ModelForm):
         model = ProductAmount
         exclude = ('from_product',)
 
+class ProductToProductInlineFormset(BaseInlineFormSet):
+    def clean(self):
+        if any(self.errors):
+            return
+        sub_products = []
+        for form in self.forms:
+            if form.cleaned_data and not form.cleaned_data.get('DELETE'):
+                sub_products.append(form.cleaned_data['to_product'])
+        #a new product can't be used by anything yet
+        if not self.instance.pk or not sub_products:
+            return
+        #product can't be its own sub product, directly or through another sub product
+        if (self.instance in sub_products or
+            self.instance.pk in get_descendant_ids([p.pk for p in sub_products])):
+            raise forms.ValidationError('A product can\'t be a sub product of itself.')
+
 #include fk_name because m2m relationship between self (products)
 ProductToProductFormSet = inlineformset_factory(Product, ProductAmount, fk_name='from_product',
-                                                form=ProductToProductForm, extra=1)
+                                                form=ProductToProductForm, extra=1,
+                                                formset=ProductToProductInlineFormset)
         
 class ProductLocationForm(ModelForm):
     location=forms.ModelChoiceField(queryset=Location.objects.order_by('name'))
@@ -190,11 +229,19 @@ class CustomInlineFormset(BaseInlineFormSet):
                    raise forms.ValidationError('Fields must have unique names and types.')
                         
 
-FieldFormSet = inlineformset_factory(Type, Field, form=FieldForm, extra=35, max_num=35,
+FieldFormSet = inlineformset_factory(Type, Field, form=FieldForm, extra=35,
                                      formset=CustomInlineFormset)
 
 #edit part type requires field types to be selected
 class EditFieldForm(ModelForm):
+    def __init__(self, *args, **kwargs):
+        #keys from char1 up to key_count can be picked
+        key_count = kwargs.pop('key_count')
+        super(EditFieldForm, self).__init__(*args, **kwargs)
+        self.fields['fields'] = forms.ChoiceField(
+            label='Field Type', choices=[('', '---------')] +
+            [(field_key(number), 'Character %d' % number) for number in range(1, key_count + 1)])
+
     class Meta:
         model = Field
         exclude = ()
@@ -204,6 +251,13 @@ class EditFieldForm(ModelForm):
         }
 
 class EditCustomInlineFormset(BaseInlineFormSet):
+    def get_form_kwargs(self, index):
+        #enough keys for every field the type has plus one for each blank form
+        kwargs = super(EditCustomInlineFormset, self).get_form_kwargs(index)
+        numbers = [field_key_number(field.fields) for field in self.get_queryset()]
+        kwargs['key_count'] = max(numbers + [len(numbers)]) + self.extra
+        return kwargs
+
     def clean(self):
         if any(self.errors):
             return
@@ -235,7 +289,7 @@ class EditCustomInlineFormset(BaseInlineFormSet):
                    raise forms.ValidationError('All field names must have an associated type.')
 
                         
-EditFieldFormSet = inlineformset_factory(Type, Field, form=EditFieldForm, extra=35, max_num=35,
+EditFieldFormSet = inlineformset_factory(Type, Field, form=EditFieldForm, extra=35,
                                      formset=EditCustomInlineFormset)
 
 class QuickTypeForm(forms.Form):
@@ -248,28 +302,75 @@ class MergeVendorsForm(forms.Form):
         alias = forms.ModelChoiceField(label='Vendor To Delete',
                                          queryset = Vendor.objects.order_by('name'))
 
+        def clean(self):
+                super(MergeVendorsForm, self).clean()
+                primary = self.cleaned_data.get('primary')
+                if primary is not None and primary == self.cleaned_data.get('alias'):
+                    raise forms.ValidationError('Choose two different vendors to merge.')
+                return self.cleaned_data
+
 class MergeLocationsForm(forms.Form):
         primary = forms.ModelChoiceField(label='Primary Location',
                                          queryset = Location.objects.order_by('name'))
         alias = forms.ModelChoiceField(label='Location To Delete',
                                          queryset = Location.objects.order_by('name'))
 
+        def clean(self):
+                super(MergeLocationsForm, self).clean()
+                primary = self.cleaned_data.get('primary')
+                if primary is not None and primary == self.cleaned_data.get('alias'):
+                    raise forms.ValidationError('Choose two different locations to merge.')
+                return self.cleaned_data
+
 #used in part list view to filter parts displayed in table
 class FilterForm(forms.Form):
         def __init__(self,*args,**kwargs):
                 models = kwargs.pop('models')
                 type_id = kwargs.pop('type_id')
-                partType = Type.objects.get(id=type_id)
                 super(FilterForm, self).__init__(*args, **kwargs)
-                self.fields['location'].queryset = Location.objects.filter(part__partType=partType).distinct()
-                self.fields['manufacturer'].queryset = Vendor.objects.filter(part__partType=partType).distinct()
+                #choices for every field come from the type's cached facets, labelled with part counts
+                facets = get_type_facets(type_id, list(models))
+                self.fields['location'].choices = [(id, '%s (%d)' % (name, count))
+                                                   for id, name, count in facets['location']]
+                self.fields['manufacturer'].choices = [(id, '%s (%d)' % (name, count))
+                                                       for id, name, count in facets['manufacturer']]
                 for field, name in models.items():
-                        self.fields[field] = forms.ModelMultipleChoiceField(Part.objects.filter(partType=partType).values_list(field, flat=True).distinct(), required=False)
+                        self.fields[field] = forms.MultipleChoiceField(
+                                choices=[(value, '%s (%d)' % (value, count))
+                                         for value, count in facets['fields'][field]],
+                                required=False)
                         self.fields[field].label = name
-                
+                #fields with numbers ("10kOhms") can also be filtered by range or closest value
+                numeric = [(field, low, high, unit) for field, low, high, unit in facets['ranges']
+                           if field in models]
+                for field, low, high, unit in numeric:
+                        self.fields[field + '__min'] = forms.CharField(
+                                required=False, label='%s from' % models[field],
+                                widget=forms.TextInput(attrs={'placeholder': format_quantity(low, unit)}))
+                        self.fields[field + '__max'] = forms.CharField(
+                                required=False, label='to',
+                                widget=forms.TextInput(attrs={'placeholder': format_quantity(high, unit)}))
+                if numeric:
+                        self.fields['near_field'] = forms.ChoiceField(
+                                required=False, label='Closest value of',
+                                choices=[('', '---------')] + [(field, models[field])
+                                                               for field, low, high, unit in numeric])
+                        self.fields['near'] = forms.CharField(required=False, label='to')
+
         search = forms.CharField(required=False)
-        location = forms.ModelMultipleChoiceField(required=False, queryset = Location.objects.none())
-        manufacturer = forms.ModelMultipleChoiceField(required=False, queryset = Vendor.objects.none())                    
+        search_mode = forms.ChoiceField(required=False, choices=SEARCH_MODES, label='Search by')
+        location = forms.MultipleChoiceField(required=False)
+        manufacturer = forms.MultipleChoiceField(required=False)
+
+class ImportPartsForm(forms.Form):
+        file = forms.FileField(help_text='(csv or xlsx, the first row names the columns)')
+
+        def clean_file(self):
+                upload = self.cleaned_data['file']
+                problem = file_problem(upload, upload.name)
+                if problem:
+                        raise forms.ValidationError(problem)
+                return upload
 
 class PurchaseOrderForm(ModelForm):
     class Meta:
@@ -277,6 +378,10 @@ class PurchaseOrderForm(ModelForm):
         exclude = ('part',)
 
 class POPartForm(ModelForm):
+    def __init__(self, *args, **kwargs):
+        super(POPartForm, self).__init__(*args, **kwargs)
+        limit_part_choices(self)
+
     #used to narrow down part selection dropdown with javascript
     #mark_safe - lets you added html elements to text
     search = forms.CharField(required=False, help_text=mark_safe('(Can search part type,' +
@@ -314,6 +419,32 @@ class APIForm(forms.Form):
                     raise forms.ValidationError('Can\'t enter a mouser part number, must be a manufacturer number for Mouser.')
                 return self.cleaned_data
 
+#a list of scanned barcodes or typed part numbers, one per line
+class IntakeForm(forms.Form):
+        website = forms.ChoiceField(choices=IntakeBatch.WEBSITE_CHOICES, required=True)
+        entry_type = forms.ChoiceField(label='Entries are', choices=IntakeBatch.ENTRY_CHOICES,
+                                       help_text='(Mouser barcodes are manufacturer part numbers)')
+        entries = forms.CharField(widget=forms.Textarea(attrs={'autofocus': True}),
+                                  help_text='(one barcode or part number per line)')
+
+        def clean(self):
+                super(IntakeForm, self).clean()
+                if (self.cleaned_data.get('website') == "Mouser" and
+                    self.cleaned_data.get('entry_type') == 'partNumber'):
+                    raise forms.ValidationError('Can\'t enter a mouser part number, must be a manufacturer number for Mouser.')
+                return self.cleaned_data
+
+        def clean_entries(self):
+                max_length = IntakeItem._meta.get_field('search').max_length
+                entries = [line.strip() for line in self.cleaned_data['entries'].splitlines()]
+                entries = [entry for entry in entries if entry]
+                if not entries:
+                    raise forms.ValidationError('Enter at least one barcode or part number.')
+                for entry in entries:
+                    if len(entry) > max_length:
+                        raise forms.ValidationError('%s is longer than %d characters.' % (entry, max_length))
+                return entries
+
 """api requires tokens to operate, can save them here to make it easier to switch b/w
 production and development since they share tokens"""
 class EnterTokensForm(forms.Form):
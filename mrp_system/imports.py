@@ -0,0 +1,295 @@
+import codecs, csv, zipfile
+from django.db import connection, transaction
+from django.db.models.functions import Lower
+from django.utils import timezone
+from mrp_system.models import (Part, Vendor, Location, ManufacturerRelationship, LocationRelationship,
+                               PlanningChange, PartImport, allocate_engi_partnumbers)
+from mrp_system.jobs import enqueue
+from mrp_system.search import update_search_vector
+from mrp_system.parametric import update_part_values
+from mrp_system.attributes import ATTRIBUTE_MAX_LENGTH
+from mrp_system.mrp import update_part_stock
+from mrp_system.facets import invalidate_facets
+
+#rows are saved this many at a time, each batch in its own transaction
+IMPORT_BATCH_SIZE = 1000
+
+#column headers (lower case) that aren't one of the type's fields
+COLUMN_ALIASES = {
+    'description': 'description',
+    'manufacturer': 'manufacturer',
+    'manufacturer part number': 'partNumber',
+    'mfr part number': 'partNumber',
+    'part number': 'partNumber',
+    'location': 'location',
+    'stock': 'stock',
+    'quantity': 'stock',
+}
+
+class ImportResult(object):
+    def __init__(self):
+        self.created = 0
+        #(row number, message) for every row that was skipped
+        self.errors = []
+
+    def error(self, row_number, message):
+        self.errors.append((row_number, message))
+
+class DecodedLines(object):
+    """the lines of a binary file as text, for csv.reader. A line that isn't
+    utf-8 raises UnicodeDecodeError for that line only, the lines after it can
+    still be read"""
+
+    def __init__(self, file):
+        self.lines = iter(file)
+        #a byte order mark is dropped from the start of the file
+        self.encoding = 'utf-8-sig'
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = next(self.lines)
+        encoding, self.encoding = self.encoding, 'utf-8'
+        return line.decode(encoding)
+
+def read_rows(file, filename):
+    """yield each row of a csv or xlsx file as a list of values, the first is
+    the header. A csv row that can't be read is yielded as the error instead
+    so the rest of the file is still imported. file is opened in binary mode
+    and never read into memory at once"""
+    if filename.lower().endswith('.xlsx'):
+        #openpyxl comes with django-import-export
+        import openpyxl
+        workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+        for row in workbook.active.iter_rows():
+            yield [cell.value for cell in row]
+        workbook.close()
+    else:
+        rows = csv.reader(DecodedLines(file))
+        while True:
+            try:
+                yield next(rows)
+            except StopIteration:
+                return
+            except (UnicodeDecodeError, csv.Error) as e:
+                yield e
+
+def file_problem(file, filename):
+    """why a file can't be imported, or None. xlsx files have to be a zip file,
+    anything else is read as a csv file and has to be utf-8 text"""
+    file.seek(0)
+    try:
+        if filename.lower().endswith('.xlsx'):
+            if not zipfile.is_zipfile(file):
+                return 'The file isn\'t an xlsx workbook.'
+        else:
+            decoder = codecs.getincrementaldecoder('utf-8')()
+            for chunk in iter(lambda: file.read(64 * 1024), b''):
+                decoder.decode(chunk)
+            decoder.decode(b'', final=True)
+    except UnicodeDecodeError:
+        return 'The file isn\'t utf-8 text, save it as "CSV UTF-8" or as an xlsx workbook.'
+    finally:
+        file.seek(0)
+    return None
+
+def row_problem(error):
+    #message for a row read_rows couldn't read
+    if isinstance(error, UnicodeDecodeError):
+        return 'The row isn\'t utf-8 text.'
+    return 'The row can\'t be read: %s' % error
+
+def get_columns(partType, header):
+    """index of each column mapped to a Part field, 'manufacturer', 'partNumber',
+    'location' or 'stock'. Columns are matched to the type's field names or
+    their keys (charN), fields are mapped to their key"""
+    names = dict(COLUMN_ALIASES)
+    for field in partType.field.all():
+        names[field.name.strip().lower()] = field.fields
+        names[field.fields.lower()] = field.fields
+    columns = {}
+    for index, heading in enumerate(header):
+        name = names.get(str(heading or '').strip().lower())
+        if name and name not in columns:
+            columns[name] = index
+    return columns
+
+class PartImporter(object):
+    """creates parts of one type from rows of values, manufacturers and locations
+    are looked up (or created) once each and kept for the rest of the import"""
+
+    def __init__(self, partType, columns, batch_size=IMPORT_BATCH_SIZE):
+        self.partType = partType
+        self.columns = columns
+        self.batch_size = batch_size
+        self.result = ImportResult()
+        self.fields = list(partType.field.values_list('fields', flat=True))
+        self.batch = []
+        self.vendors = {vendor.name.lower(): vendor for vendor in Vendor.objects.all()}
+        self.locations = {location.name.lower(): location for location in Location.objects.all()}
+        #manufacturer part numbers already entered or earlier in the file
+        self.part_numbers = set()
+
+    def value(self, row, name):
+        index = self.columns.get(name)
+        if index is None or index >= len(row) or row[index] is None:
+            return ''
+        return str(row[index]).strip()
+
+    def get_vendor(self, name):
+        vendor = self.vendors.get(name.lower())
+        if vendor is None:
+            vendor, created = Vendor.objects.get_or_create(name=name)
+            self.vendors[name.lower()] = vendor
+        return vendor
+
+    def get_location(self, name):
+        location = self.locations.get(name.lower())
+        if location is None:
+            location, created = Location.objects.get_or_create(name=name)
+            self.locations[name.lower()] = location
+        return location
+
+    def add_row(self, row_number, row):
+        #check one row and queue it to be saved, bad rows are recorded and skipped
+        if all(value in (None, '') for value in row):
+            return
+        part = Part(partType=self.partType, description=self.value(row, 'description'))
+        for field in self.fields:
+            part.set_attribute(field, self.value(row, field))
+        manufacturer = self.value(row, 'manufacturer')
+        part_number = self.value(row, 'partNumber')
+        location = self.value(row, 'location')
+        stock = self.value(row, 'stock')
+        checks = [('description', part.description, Part._meta.get_field('description')),
+                  ('manufacturer', manufacturer, Vendor._meta.get_field('name')),
+                  ('part number', part_number, ManufacturerRelationship._meta.get_field('partNumber')),
+                  ('location', location, Location._meta.get_field('name'))]
+        checks = [(name, value, model_field.max_length) for name, value, model_field in checks]
+        checks += [(field, part.get_attribute(field), ATTRIBUTE_MAX_LENGTH) for field in self.fields]
+        for name, value, max_length in checks:
+            if len(value) > max_length:
+                return self.result.error(row_number, 'The %s is longer than %d characters.'
+                                         % (name, max_length))
+            #postgres can't store it
+            if '\x00' in value:
+                return self.result.error(row_number, 'The %s has a NUL character in it.' % name)
+        if part_number and not manufacturer:
+            return self.result.error(row_number, 'Part number %s has no manufacturer.' % part_number)
+        if part_number.lower() in self.part_numbers:
+            return self.result.error(row_number, 'Part number %s is entered more than once.' % part_number)
+        try:
+            stock = int(float(stock)) if stock else None
+        except (ValueError, OverflowError):
+            return self.result.error(row_number, 'Stock "%s" is not a number.' % stock)
+        low, high = connection.ops.integer_field_range('IntegerField')
+        if stock is not None and not low <= stock <= high:
+            return self.result.error(row_number, 'Stock %d is out of range.' % stock)
+        if part_number:
+            self.part_numbers.add(part_number.lower())
+        self.batch.append((row_number, part, manufacturer, part_number, location, stock))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """save the queued rows, parts and their relationships are inserted with
+        one query each. bulk_create skips save() and signals so part numbers,
+        search vectors, stock totals and facets are filled in here"""
+        batch, self.batch = self.batch, []
+        part_numbers = [part_number.lower() for row_number, part, manufacturer, part_number, location, stock
+                        in batch if part_number]
+        #case is ignored, like the check for numbers entered twice in the file
+        existing = set(ManufacturerRelationship.objects.annotate(number=Lower('partNumber'))
+                       .filter(number__in=part_numbers).values_list('number', flat=True))
+        rows = []
+        for row in batch:
+            row_number, part, manufacturer, part_number, location, stock = row
+            if part_number.lower() in existing:
+                self.result.error(row_number, 'Part number %s already exists.' % part_number)
+            else:
+                rows.append(row)
+        if not rows:
+            return
+        with transaction.atomic():
+            numbers = allocate_engi_partnumbers(self.partType, len(rows))
+            for row, number in zip(rows, numbers):
+                row[1].engimusingPartNumber = number
+            Part.objects.bulk_create([row[1] for row in rows])
+            manufacturers = []
+            locations = []
+            for row_number, part, manufacturer, part_number, location, stock in rows:
+                if manufacturer:
+                    manufacturers.append(ManufacturerRelationship(
+                        part=part, manufacturer=self.get_vendor(manufacturer), partNumber=part_number))
+                if location:
+                    locations.append(LocationRelationship(
+                        part=part, location=self.get_location(location), stock=stock))
+            ManufacturerRelationship.objects.bulk_create(manufacturers)
+            LocationRelationship.objects.bulk_create(locations)
+            stocked = [location.part_id for location in locations]
+            update_search_vector([row[1].id for row in rows])
+            update_part_values([row[1].id for row in rows])
+            update_part_stock(stocked)
+            PlanningChange.objects.bulk_create([PlanningChange(part_id=part_id) for part_id in stocked])
+        self.result.created += len(rows)
+
+    def finish(self):
+        self.flush()
+        invalidate_facets([self.partType.id])
+        return self.result
+
+def import_parts(partType, file, filename, batch_size=IMPORT_BATCH_SIZE):
+    """create parts of partType from a csv or xlsx file, returns an ImportResult.
+    Rows with errors are skipped and reported, the rest are still imported"""
+    rows = read_rows(file, filename)
+    header = next(rows, [])
+    errors = []
+    if isinstance(header, Exception):
+        errors.append((1, row_problem(header)))
+        header = []
+    importer = PartImporter(partType, get_columns(partType, header), batch_size)
+    importer.result.errors += errors
+    #row numbers count the header as row 1, like a spreadsheet
+    for row_number, row in enumerate(rows, 2):
+        if isinstance(row, Exception):
+            importer.result.error(row_number, row_problem(row))
+        else:
+            importer.add_row(row_number, row)
+    return importer.finish()
+
+def run_import(import_id):
+    #job that imports the parts of an uploaded file
+    part_import = PartImport.objects.select_related('partType').get(id=import_id)
+    part_import.status = 'running'
+    part_import.save()
+    try:
+        with part_import.file.open('rb') as file:
+            result = import_parts(part_import.partType, file, part_import.filename)
+        part_import.created = result.created
+        part_import.errors = result.errors
+        part_import.status = 'done'
+    except Exception as e:
+        part_import.status = 'failed'
+        part_import.message = str(e)[:300]
+        raise
+    finally:
+        part_import.date_finished = timezone.now()
+        part_import.save()
+
+def import_failed(import_id):
+    #the job gave up without finishing the import, eg. its worker stopped
+    (PartImport.objects.filter(id=import_id, status__in=('pending', 'running'))
+     .update(status='failed', message='The import stopped before it finished.',
+             date_finished=timezone.now()))
+
+run_import.on_failure = import_failed
+
+def start_import(partType, upload):
+    """save an uploaded file and queue it to be imported, returns the
+    PartImport"""
+    with transaction.atomic():
+        part_import = PartImport.objects.create(partType=partType, file=upload, filename=upload.name)
+        #not tried again, the rows saved before it failed would be imported twice
+        enqueue(run_import, max_attempts=1, import_id=part_import.id)
+    return part_import
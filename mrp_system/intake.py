@@ -0,0 +1,265 @@
+import re, threading, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.utils import timezone
+from mrp_system.models import (Part, Type, Field, Vendor, ManufacturerRelationship,
+                               IntakeBatch, IntakeItem, allocate_engi_partnumbers)
+from mrp_system.digikey import get_client, DigiKeyError
+from mrp_system.search import update_search_vector
+from mrp_system.parametric import update_part_values
+from mrp_system.facets import invalidate_facets
+from mrp_system.jobs import enqueue, enqueue_many
+from mrp_system.attributes import field_key
+
+#lookups running at once in a batch
+INTAKE_WORKERS = 8
+#digikey api calls per second over all of a batch's threads, their quota is per minute
+INTAKE_RATE = 2
+
+class RateLimiter(object):
+    #spaces calls at least 1/rate seconds apart, shared by every thread of a batch
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.lock = threading.Lock()
+        self.next_time = 0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        time.sleep(start - now)
+
+def type_prefix(typeName):
+    #prefix of a new part type, based on amount of words in type name
+    #get all words in type name, exclude -'s
+    list_name = re.findall(r'\w+', typeName)
+    word_count = len(list_name)
+    prefix = ""
+    if word_count == 1:
+        prefix = typeName[:3].upper()
+    if word_count == 2:
+        prefix = (list_name[0][:1] + list_name[1][:2]).upper()
+    if word_count >= 3:
+        prefix = (list_name[0][:1] + list_name[1][:1] + list_name[2][:1]).upper()
+    return prefix
+
+def part_params(part):
+    #{parameter name: value} of all parameters returned from the api
+    return {value['Parameter']: value['Value'] for value in part['Parameters']}
+
+def get_part_type(part, params):
+    """(Type, its fields) for the digikey family of part. A new type gets a
+    prefix and a field for every parameter"""
+    typeName = part['Family']['Text']
+    with transaction.atomic():
+        partType, created = Type.objects.get_or_create(name=typeName,
+                                                       defaults={'prefix': type_prefix(typeName)})
+        if created:
+            names = list(params)
+            #series is always separate from the other parameters
+            try:
+                part['Series']['Parameter']
+                names.insert(0, 'Series')
+            except (IndexError, KeyError, TypeError):
+                pass
+            Field.objects.bulk_create([Field(name=name, fields=field_key(count), typePart=partType)
+                                       for count, name in enumerate(names, 1)])
+    return partType, list(Field.objects.filter(typePart=partType))
+
+def set_part_fields(new_part, part, params, fields):
+    #fill in the part's fields from a digikey part
+    for field in fields:
+        name = field.name
+        #composition parameter is formatted differently
+        if name == "Composition":
+            try:
+                new_part.set_attribute(field.fields, part['Family']['Text'])
+            except (IndexError, KeyError):
+                pass
+        #try to get each value and assign it to the part
+        try:
+            new_part.set_attribute(field.fields, part[name]['Value'])
+        except (IndexError, KeyError, TypeError):
+            try:
+                new_part.set_attribute(field.fields, params[name])
+            except (IndexError, KeyError):
+                pass
+
+def part_description(part):
+    return part['DetailedDescription'] or part['ProductDescription']
+
+def part_manufacturer(part):
+    #(manufacturer name, manufacturer part number) or (None, None)
+    try:
+        return part['ManufacturerName']['Text'], part['ManufacturerPartNumber']
+    except (IndexError, KeyError, TypeError):
+        return None, None
+
+def datasheet_url(part):
+    #url of the part's pdf datasheet, or None
+    url = part.get('PrimaryDatasheet') or ''
+    return url if 'pdf' in url else None
+
+def fetch_datasheet(part_id, url):
+    """job that downloads a part's datasheet and saves it to storage (S3).
+    Raises if the site can't be reached so the job is tried again later"""
+    content = get_client().download(url)
+    part = Part.objects.filter(id=part_id).first()
+    if part is None:
+        return
+    if content is not None:
+        part.datasheet.save(urlparse(url).path.split('/')[-1], ContentFile(content), save=False)
+    #update() so saving the file doesn't redo the part's search vector, facets etc.
+    Part.objects.filter(id=part_id).update(datasheet=part.datasheet.name, datasheet_pending=False)
+
+def datasheet_failed(part_id, url):
+    #the job gave up, the part no longer shows its datasheet as pending
+    Part.objects.filter(id=part_id).update(datasheet_pending=False)
+
+fetch_datasheet.on_failure = datasheet_failed
+
+def lookup(client, limiter, website, entry_type, search):
+    #the digikey part for one entered barcode or part number, or None
+    if website == 'Digi-Key' and entry_type == 'barcode':
+        limiter.wait()
+        search = client.barcode_part_number(search)
+        if not search:
+            return None
+    limiter.wait()
+    return client.find_part(search)
+
+def resolve_items(batch, items):
+    """look every distinct search of a batch up concurrently, returns
+    {search: digikey part} for the ones found. Items are marked as they come
+    back so the status page shows progress"""
+    client = get_client()
+    limiter = RateLimiter(INTAKE_RATE)
+    searches = {}
+    for item in items:
+        searches.setdefault(item.search, []).append(item.id)
+
+    def run(search):
+        try:
+            return lookup(client, limiter, batch.website, batch.entry_type, search)
+        finally:
+            #every thread opens its own connection to read the access token
+            connection.close()
+
+    found = {}
+    with ThreadPoolExecutor(max_workers=INTAKE_WORKERS) as pool:
+        futures = {pool.submit(run, search): search for search in searches}
+        for future in as_completed(futures):
+            search = futures[future]
+            try:
+                part = future.result()
+            except DigiKeyError as e:
+                status, message = 'error', str(e)
+            else:
+                if part is None:
+                    status, message = 'not_found', ''
+                else:
+                    status, message = 'found', part_description(part)
+                    found[search] = part
+            IntakeItem.objects.filter(id__in=searches[search]).update(status=status,
+                                                                      message=message[:300])
+    return found
+
+def create_parts(batch, found):
+    """create the parts found for a batch, skipping manufacturer part numbers
+    that already exist (checked with one query). Vendors, parts and their
+    manufacturers are inserted in bulk, returns [(part, datasheet url)]"""
+    manufacturers = {search: part_manufacturer(part) for search, part in found.items()}
+    numbers = [number for name, number in manufacturers.values() if number]
+    #this is our way of checking for duplicates
+    existing = {(name, number): part_id for name, number, part_id
+                in ManufacturerRelationship.objects.filter(partNumber__in=numbers)
+                .values_list('manufacturer__name', 'partNumber', 'part_id')}
+    names = set(name for name, number in manufacturers.values() if name)
+    vendors = Vendor.objects.in_bulk(names, field_name='name')
+    Vendor.objects.bulk_create([Vendor(name=name, vendor_type="manufacturer")
+                                for name in names if name not in vendors])
+    vendors = Vendor.objects.in_bulk(names, field_name='name')
+    #parts to create for each type as [(search, Part, digikey part)]
+    new_parts = {}
+    #new part of each search, the same part scanned twice in a batch is only created once
+    parts = {}
+    batch_parts = {}
+    for search, part in found.items():
+        name, number = manufacturers[search]
+        items = batch.items.filter(search=search)
+        if (name, number) in existing:
+            items.update(status='exists', part=existing[(name, number)],
+                         message='Manufacturer Part Number already exists.')
+            continue
+        if name and (name, number) in batch_parts:
+            parts[search] = batch_parts[(name, number)]
+            continue
+        params = part_params(part)
+        partType, fields = get_part_type(part, params)
+        new_part = Part(partType=partType, description=part_description(part),
+                        datasheet_pending=bool(datasheet_url(part)))
+        set_part_fields(new_part, part, params, fields)
+        new_parts.setdefault(partType, []).append((search, new_part, part))
+        parts[search] = new_part
+        if name:
+            batch_parts[(name, number)] = new_part
+    created = []
+    with transaction.atomic():
+        for partType, rows in new_parts.items():
+            for row, number in zip(rows, allocate_engi_partnumbers(partType, len(rows))):
+                row[1].engimusingPartNumber = number
+            Part.objects.bulk_create([new_part for search, new_part, part in rows])
+            relationships = []
+            for search, new_part, part in rows:
+                name, number = manufacturers[search]
+                if name:
+                    relationships.append(ManufacturerRelationship(
+                        part=new_part, manufacturer=vendors[name], partNumber=number))
+                created.append((new_part, datasheet_url(part)))
+            ManufacturerRelationship.objects.bulk_create(relationships)
+        update_search_vector([new_part.id for new_part, url in created])
+        update_part_values([new_part.id for new_part, url in created])
+    for search, new_part in parts.items():
+        batch.items.filter(search=search).update(status='created', part=new_part)
+    invalidate_facets([partType.id for partType in new_parts])
+    return created
+
+def run_intake(batch_id):
+    #job that looks up and creates the parts of a batch
+    batch = IntakeBatch.objects.get(id=batch_id)
+    batch.status = 'running'
+    batch.save()
+    try:
+        found = resolve_items(batch, list(batch.items.all()))
+        created = create_parts(batch, found)
+        enqueue_many(fetch_datasheet, [{'part_id': part.id, 'url': url}
+                                       for part, url in created if url])
+        batch.status = 'done'
+    except Exception as e:
+        batch.status = 'failed'
+        batch.message = str(e)[:300]
+        raise
+    finally:
+        batch.date_finished = timezone.now()
+        batch.save()
+
+def intake_failed(batch_id):
+    #the job gave up without finishing the batch, eg. its worker stopped
+    (IntakeBatch.objects.filter(id=batch_id, status__in=('pending', 'running'))
+     .update(status='failed', message='The lookup stopped before it finished.',
+             date_finished=timezone.now()))
+
+run_intake.on_failure = intake_failed
+
+def start_intake(website, entry_type, searches):
+    """save a batch of barcodes/part numbers and queue it to be looked up,
+    returns the batch"""
+    with transaction.atomic():
+        batch = IntakeBatch.objects.create(website=website, entry_type=entry_type)
+        IntakeItem.objects.bulk_create([IntakeItem(batch=batch, search=search) for search in searches])
+        #not tried again, the lookups would all be repeated
+        enqueue(run_intake, max_attempts=1, batch_id=batch.id)
+    return batch
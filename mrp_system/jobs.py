@@ -0,0 +1,150 @@
+import datetime, threading, time, traceback
+from django.db import connection, transaction, close_old_connections
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from mrp_system.models import Job
+
+#a failed job is tried again after 30s, 1m, 2m... up to an hour
+RETRY_BACKOFF = 30
+RETRY_MAX_DELAY = 60 * 60
+#seconds an idle worker waits before looking for jobs again
+POLL_INTERVAL = 2
+#seconds between a worker touching its running job's date_started
+HEARTBEAT_INTERVAL = 60
+#a running job whose date_started hasn't been touched for this long is assumed
+#to have lost its worker and is run again, if it has attempts left
+JOB_TIMEOUT = datetime.timedelta(minutes=10)
+
+def task_path(func):
+    return '%s.%s' % (func.__module__, func.__name__)
+
+def enqueue(func, max_attempts=5, **kwargs):
+    """queue func(**kwargs) for the worker, kwargs must be json. The job is
+    saved in the current transaction so it only runs if that commits"""
+    return Job.objects.create(task=task_path(func), kwargs=kwargs, max_attempts=max_attempts)
+
+def enqueue_many(func, kwargs_list, max_attempts=5):
+    #queue func once for each kwargs with one insert
+    return Job.objects.bulk_create([Job(task=task_path(func), kwargs=kwargs, max_attempts=max_attempts)
+                                    for kwargs in kwargs_list])
+
+def retry_delay(attempts):
+    return datetime.timedelta(seconds=min(RETRY_BACKOFF * 2 ** (attempts - 1), RETRY_MAX_DELAY))
+
+def fail_job(job, func=None):
+    """job that ran out of attempts, the task's on_failure(**kwargs) is called
+    if it has one. If that raises too its traceback is added to last_error"""
+    job.status = 'failed'
+    job.date_finished = timezone.now()
+    if func is None:
+        try:
+            func = import_string(job.task)
+        except ImportError:
+            pass
+    on_failure = getattr(func, 'on_failure', None)
+    if on_failure is None:
+        return
+    try:
+        on_failure(**job.kwargs)
+    except Exception:
+        job.last_error += '\non_failure raised:\n' + traceback.format_exc()
+
+def requeue_stale_jobs():
+    """jobs whose worker died part way through are queued again, or failed if
+    that was their last attempt. Returns the number queued again"""
+    stale = Job.objects.filter(status='running', date_started__lt=timezone.now() - JOB_TIMEOUT)
+    for job in stale.filter(attempts__gte=F('max_attempts')):
+        #update() first so only one worker fails each job
+        if Job.objects.filter(id=job.id, status='running').update(status='failed'):
+            job.last_error = 'The worker running the job stopped.'
+            fail_job(job)
+            job.save()
+    return stale.filter(attempts__lt=F('max_attempts')).update(status='queued', run_at=timezone.now())
+
+def claim_job():
+    """the next job that's due, marked running. Jobs locked by another worker
+    are skipped so any number of workers can share the queue"""
+    with transaction.atomic():
+        job = (Job.objects.select_for_update(skip_locked=True)
+               .filter(status='queued', run_at__lte=timezone.now())
+               .order_by('run_at', 'id').first())
+        if job is not None:
+            job.status = 'running'
+            job.attempts += 1
+            job.date_started = timezone.now()
+            job.save()
+        return job
+
+def running(job):
+    #the job as long as it's still the same attempt this worker claimed
+    return Job.objects.filter(id=job.id, status='running', attempts=job.attempts)
+
+class Heartbeat(threading.Thread):
+    """touches a running job's date_started every interval seconds, so a job
+    that takes longer than JOB_TIMEOUT isn't taken for one whose worker died"""
+
+    def __init__(self, job, interval=HEARTBEAT_INTERVAL):
+        super(Heartbeat, self).__init__(daemon=True)
+        self.job = job
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        #the thread has its own database connection, closed when it's done
+        try:
+            while not self.stopped.wait(self.interval):
+                try:
+                    running(self.job).update(date_started=timezone.now())
+                except Exception:
+                    connection.close()
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+def run_job(job):
+    """run a claimed job. If it raises it's queued again with backoff until it
+    runs out of attempts, then the task's on_failure(**kwargs) is called if it has one"""
+    func = None
+    heartbeat = Heartbeat(job)
+    heartbeat.start()
+    try:
+        func = import_string(job.task)
+        func(**job.kwargs)
+    except Exception:
+        job.last_error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            job.status = 'queued'
+            job.run_at = timezone.now() + retry_delay(job.attempts)
+        else:
+            fail_job(job, func)
+    else:
+        job.status = 'done'
+        job.date_finished = timezone.now()
+    finally:
+        heartbeat.stop()
+        #left alone if another worker took the job over meanwhile
+        running(job).update(status=job.status, run_at=job.run_at, last_error=job.last_error,
+                            date_finished=job.date_finished)
+    return job
+
+def work(once=False, poll_interval=POLL_INTERVAL):
+    """run jobs until stopped, or until the queue is empty if once is True.
+    Returns the number of jobs run"""
+    count = 0
+    requeue_stale_jobs()
+    while True:
+        #a long running worker shouldn't hold on to a connection the database dropped
+        close_old_connections()
+        job = claim_job()
+        if job is None:
+            if once:
+                return count
+            time.sleep(poll_interval)
+            requeue_stale_jobs()
+            continue
+        run_job(job)
+        count += 1
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from mrp_system.duplicates import find_duplicates, FINDERS
+
+
+class Command(BaseCommand):
+    """
+    Management command that looks for vendors, locations and parts that are
+    probably entered twice and queues them on the duplicates page for review.
+    """
+    help = "Suggest duplicate vendors, locations and parts to merge."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind',
+                            action='append',
+                            dest='kinds',
+                            choices=list(FINDERS),
+                            help='Only look for this kind of duplicate, can be given more than once')
+
+    def handle(self, *args, **kwargs):
+        verbosity = kwargs.get('verbosity', 1)
+        found = find_duplicates(kwargs['kinds'])
+        if verbosity >= 1:
+            for kind, count in found.items():
+                self.stdout.write('New %s duplicates: %d' % (kind, count))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from mrp_system.imports import import_parts, IMPORT_BATCH_SIZE
+from mrp_system.models import Type
+
+
+class Command(BaseCommand):
+    """
+    Management command to create parts of one type from a csv or xlsx file.
+    Use ./manage.py import_parts --help for more details
+    """
+    help = ("Import parts from a csv or xlsx file. The first row names the columns: "
+            "the type's field names, description, manufacturer, manufacturer part "
+            "number, location and stock.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('type', help='Name or id of the part type')
+        parser.add_argument('path', help='csv or xlsx file to import')
+        parser.add_argument('--batch-size',
+                            type=int,
+                            dest='batch_size',
+                            default=IMPORT_BATCH_SIZE,
+                            help='Number of rows saved at a time')
+
+    def handle(self, *args, **kwargs):
+        verbosity = kwargs.get('verbosity', 1)
+        name = kwargs['type']
+        partType = Type.objects.filter(name=name).first()
+        if partType is None and name.isdigit():
+            partType = Type.objects.filter(id=name).first()
+        if partType is None:
+            raise CommandError('Part type "%s" does not exist.' % name)
+        try:
+            with open(kwargs['path'], 'rb') as file:
+                result = import_parts(partType, file, kwargs['path'], kwargs['batch_size'])
+        except IOError as e:
+            raise CommandError(str(e))
+        if verbosity >= 1:
+            for row_number, message in result.errors:
+                self.stderr.write('Row %d: %s' % (row_number, message))
+            self.stdout.write('Parts imported: %d, rows skipped: %d'
+                              % (result.created, len(result.errors)))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from mrp_system.parametric import index_part_values, INDEX_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    """
+    Management command to parse the numeric values of every part's fields
+    into the PartValue index used by the part list's range filters, eg. after
+    the index was added or parts were loaded without signals.
+    """
+    help = "Rebuild the numeric PartValue index of every part."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--type',
+                            type=int,
+                            dest='type_id',
+                            help='Only index parts of the type with this id')
+        parser.add_argument('--batch-size',
+                            type=int,
+                            default=INDEX_BATCH_SIZE,
+                            help='Parts indexed in each transaction')
+
+    def handle(self, *args, **kwargs):
+        verbosity = kwargs.get('verbosity', 1)
+        count = index_part_values(kwargs['type_id'], kwargs['batch_size'])
+        if verbosity >= 1:
+            self.stdout.write('Numeric values indexed: %d' % count)
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from mrp_system.bom import BOMCycleError
+from mrp_system.mrp import run_mrp
+
+
+class Command(BaseCommand):
+    """
+    Management command to plan the combined requirements of all open
+    manufacturing orders. Use ./manage.py mrp_run --help for more details
+    """
+    help = ("Net the demand of all open manufacturing orders against stock and "
+            "open purchase orders, recomputing only what changed since the last run.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full',
+                            action='store_true',
+                            dest='full',
+                            default=False,
+                            help='Recompute every requirement, not just what changed')
+
+    def handle(self, *args, **kwargs):
+        verbosity = kwargs.get('verbosity', 1)
+        try:
+            saved = run_mrp(full=kwargs['full'])
+        except BOMCycleError as e:
+            raise CommandError(str(e))
+        if verbosity >= 1:
+            self.stdout.write('Planned requirements updated: %d' % saved)
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from mrp_system.search import update_search_vector
+
+
+class Command(BaseCommand):
+    """
+    Management command to recalculate the stored full text search vector of
+    every part, eg. after parts were loaded without signals.
+    """
+    help = "Recalculate Part.search_vector for every part."
+
+    def handle(self, *args, **kwargs):
+        verbosity = kwargs.get('verbosity', 1)
+        parts = update_search_vector()
+        if verbosity >= 1:
+            self.stdout.write('Search vectors rebuilt for %d parts' % parts)
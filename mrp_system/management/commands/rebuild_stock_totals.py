@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from mrp_system.mrp import update_part_stock, update_product_stock
+
+
+class Command(BaseCommand):
+    """
+    Management command to recalculate the total stock saved on every part
+    and product from their location stock.
+    """
+    help = "Recalculate Part.on_hand and Product.on_hand from location stock."
+
+    def handle(self, *args, **kwargs):
+        verbosity = kwargs.get('verbosity', 1)
+        parts = update_part_stock()
+        products = update_product_stock()
+        if verbosity >= 1:
+            self.stdout.write('Stock totals rebuilt for %d parts and %d products' % (parts, products))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from mrp_system.jobs import work, POLL_INTERVAL
+
+
+class Command(BaseCommand):
+    """
+    Management command that runs queued jobs (datasheet downloads, batch part
+    lookups). Run one or more of these next to the web process.
+    """
+    help = "Run queued background jobs, retrying failed ones with backoff."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once',
+                            action='store_true',
+                            dest='once',
+                            default=False,
+                            help='Stop once there are no jobs due instead of waiting for more')
+        parser.add_argument('--poll-interval',
+                            type=float,
+                            dest='poll_interval',
+                            default=POLL_INTERVAL,
+                            help='Seconds to wait between looking for new jobs')
+
+    def handle(self, *args, **kwargs):
+        verbosity = kwargs.get('verbosity', 1)
+        count = work(once=kwargs['once'], poll_interval=kwargs['poll_interval'])
+        if verbosity >= 1:
+            self.stdout.write('Jobs run: %d' % count)
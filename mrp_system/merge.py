@@ -0,0 +1,114 @@
+from django.db import connection, models, transaction
+from mrp_system.models import (Part, ManufacturerRelationship, LocationRelationship, ProductLocation,
+                               PartAmount, PlannedRequirement, PlanningChange, PartValue)
+from mrp_system.search import update_search_vector
+from mrp_system.parametric import update_part_values
+from mrp_system.mrp import update_part_stock, update_product_stock
+from mrp_system.bom import invalidate_bom
+from mrp_system.facets import invalidate_facets
+
+"""tables where a row should only appear once for the merged object and the
+columns given, keyed by (model, foreign key being merged), e.g. a part is only
+stocked once in a location. Alias rows that duplicate one of primary's are
+folded into it, adding up the total column"""
+MERGE_KEYS = {
+    (ManufacturerRelationship, 'manufacturer'): (['part', 'partNumber'], None),
+    (ManufacturerRelationship, 'part'): (['manufacturer', 'partNumber'], None),
+    (LocationRelationship, 'location'): (['part'], 'stock'),
+    (LocationRelationship, 'part'): (['location'], 'stock'),
+    (ProductLocation, 'location'): (['product'], 'stock'),
+    (PartAmount, 'part'): (['product'], 'amount'),
+    #recalculated by the next mrp run anyway
+    (PlannedRequirement, 'part'): ([], None),
+    #primary's values are indexed again from its own fields after the merge
+    (PartValue, 'part'): (['field'], None),
+}
+
+#vendor and location names are part of the search text of these rows' parts
+SEARCH_MODELS = (ManufacturerRelationship, LocationRelationship)
+
+#stock of a row that's unknown (null) on one side is taken from the other.
+#Nothing stops primary having the same key twice itself, alias's total is only
+#added to the first of those rows
+FOLD_SQL = """
+UPDATE {table} p SET {total} = COALESCE(p.{total} + a.{total}, p.{total}, a.{total})
+FROM (SELECT {select} SUM({total}) AS {total} FROM {table} WHERE {fk} = %s {group}) a
+WHERE p.{pk} = (SELECT MIN(f.{pk}) FROM {table} f WHERE f.{fk} = %s AND {first})
+"""
+
+DELETE_SQL = """
+DELETE FROM {table} a USING {table} p
+WHERE a.{fk} = %s AND p.{fk} = %s AND {join}
+"""
+
+def referencing_fields(model):
+    #(model, foreign key) for every foreign key pointing at model
+    return [(rel.related_model, rel.field) for rel in model._meta.related_objects
+            if isinstance(rel.field, models.ForeignKey)]
+
+def fold_duplicates(related_model, field, primary, alias):
+    #fold alias rows that primary already has into primary's, then delete them
+    key_names, total = MERGE_KEYS[(related_model, field.name)]
+    quote = connection.ops.quote_name
+    keys = [quote(related_model._meta.get_field(name).column) for name in key_names]
+    sql = {'table': quote(related_model._meta.db_table),
+           'fk': quote(field.column),
+           'select': ''.join('%s, ' % key for key in keys),
+           'group': 'GROUP BY %s' % ', '.join(keys) if keys else '',
+           'pk': quote(related_model._meta.pk.column),
+           'join': ' AND '.join('p.%s = a.%s' % (key, key) for key in keys) or 'TRUE',
+           'first': ' AND '.join('f.%s = a.%s' % (key, key) for key in keys) or 'TRUE'}
+    with connection.cursor() as cursor:
+        if total:
+            sql['total'] = quote(related_model._meta.get_field(total).column)
+            cursor.execute(FOLD_SQL.format(**sql), [alias.pk, primary.pk])
+        cursor.execute(DELETE_SQL.format(**sql), [alias.pk, primary.pk])
+
+def merge_objects(primary, alias):
+    """point every row that references alias (a vendor, location or part) at
+    primary with one UPDATE per table, then delete alias. Duplicate
+    relationships are folded together first so a part in both locations keeps
+    one row with the stock of both"""
+    if type(primary) is not type(alias):
+        raise TypeError('Only objects of the same type can be merged')
+    if primary.pk == alias.pk:
+        raise ValueError('Can\'t merge %s into itself' % primary)
+    alias_id = alias.pk
+    part_ids = set()
+    product_ids = set()
+    #parts and products whose stock rows were folded together
+    stocked_part_ids = set()
+    stocked_product_ids = set()
+    with transaction.atomic():
+        for related_model, field in referencing_fields(type(alias)):
+            rows = related_model.objects.filter(**{field.name: alias})
+            if related_model in SEARCH_MODELS:
+                part_ids.update(rows.values_list('part_id', flat=True))
+            if related_model is LocationRelationship:
+                stocked_part_ids.update(rows.values_list('part_id', flat=True))
+            if related_model is ProductLocation:
+                stocked_product_ids.update(rows.values_list('product_id', flat=True))
+            if related_model is PartAmount:
+                product_ids.update(rows.values_list('product_id', flat=True))
+            if (related_model, field.name) in MERGE_KEYS:
+                fold_duplicates(related_model, field, primary, alias)
+            rows.update(**{field.name: primary})
+        #nothing references alias anymore so this doesn't cascade
+        alias.delete()
+        if isinstance(primary, Part):
+            #stock, orders and BOMs of alias now belong to primary
+            part_ids = {primary.pk}
+            stocked_part_ids = {primary.pk}
+            update_part_values([primary.pk])
+            PlanningChange.objects.bulk_create([PlanningChange(part_id=primary.pk),
+                                                PlanningChange(part_id=alias_id)])
+            transaction.on_commit(lambda: invalidate_facets([primary.partType_id, alias.partType_id]))
+            for product_id in product_ids:
+                transaction.on_commit(lambda product_id=product_id: invalidate_bom(product_id))
+        #the totals should come out the same when only a location was merged,
+        #they're recalculated in case the rows didn't add up to them before
+        if stocked_part_ids:
+            update_part_stock(list(stocked_part_ids))
+        if stocked_product_ids:
+            update_product_stock(list(stocked_product_ids))
+        update_search_vector(list(part_ids))
@@ -0,0 +1,45 @@
+# Generated by Django 2.1.2 on 2026-10-18 09:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mrp_system', '0083_auto_20190131_1155'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlanningChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('part_id', models.IntegerField(blank=True, null=True)),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='manufacturingorder',
+            name='completed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='purchaseorder',
+            name='received',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='PlannedRequirement',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gross', models.IntegerField(default=0)),
+                ('on_hand', models.IntegerField(default=0)),
+                ('on_order', models.IntegerField(default=0)),
+                ('net', models.IntegerField(default=0)),
+                ('date_planned', models.DateTimeField(auto_now=True)),
+                ('part', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='mrp_system.Part')),
+                ('product', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='mrp_system.Product')),
+            ],
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 2.1.2 on 2026-10-18 10:00
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def calculate_stock_totals(apps, schema_editor):
+    Part = apps.get_model('mrp_system', 'Part')
+    Product = apps.get_model('mrp_system', 'Product')
+    LocationRelationship = apps.get_model('mrp_system', 'LocationRelationship')
+    ProductLocation = apps.get_model('mrp_system', 'ProductLocation')
+    part_totals = (LocationRelationship.objects.filter(part=OuterRef('pk'))
+                   .values('part').annotate(total=Sum('stock')).values('total'))
+    Part.objects.update(on_hand=Coalesce(Subquery(part_totals), 0))
+    product_totals = (ProductLocation.objects.filter(product=OuterRef('pk'))
+                      .values('product').annotate(total=Sum('stock')).values('total'))
+    Product.objects.update(on_hand=Coalesce(Subquery(product_totals), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mrp_system', '0084_mrp_run'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='part',
+            name='on_hand',
+            field=models.IntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='on_hand',
+            field=models.IntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(calculate_stock_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.1.2 on 2026-10-18 10:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mrp_system', '0085_stock_totals'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='part',
+            index=models.Index(fields=['partType', 'engimusingPartNumber', 'id'], name='mrp_system__partTyp_904c17_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 2.1.2 on 2026-10-18 10:03
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+
+def calculate_search_vectors(apps, schema_editor):
+    Part = apps.get_model('mrp_system', 'Part')
+    Type = apps.get_model('mrp_system', 'Type')
+    ManufacturerRelationship = apps.get_model('mrp_system', 'ManufacturerRelationship')
+    LocationRelationship = apps.get_model('mrp_system', 'LocationRelationship')
+
+    def related_text(model, field):
+        return Subquery(model.objects.filter(part=OuterRef('pk')).values('part')
+                        .annotate(text=StringAgg(field, ' ')).values('text'))
+
+    type_name = Subquery(Type.objects.filter(id=OuterRef('partType_id')).values('name'))
+    Part.objects.update(search_vector=(
+        SearchVector('engimusingPartNumber', weight='A') +
+        SearchVector(related_text(ManufacturerRelationship, 'partNumber'), weight='A') +
+        SearchVector('description', weight='B') +
+        SearchVector(type_name, weight='B') +
+        SearchVector(related_text(ManufacturerRelationship, 'manufacturer__name'), weight='B') +
+        SearchVector(*['char%d' % x for x in range(1, 36)], weight='C') +
+        SearchVector(related_text(LocationRelationship, 'location__name'), weight='D')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mrp_system', '0086_part_list_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='part',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='part',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='mrp_system__search__1f2142_gin'),
+        ),
+        migrations.RunPython(calculate_search_vectors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.1.2 on 2026-10-18 11:20
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mrp_system', '0087_part_search_vector'),
+    ]
+
+    #gin_trgm_ops indexes can't be declared in Meta.indexes on this Django version
+    operations = [
+        TrigramExtension(),
+        migrations.RunSQL(
+            'CREATE INDEX mrp_system_part_engi_trgm ON mrp_system_part '
+            'USING gin ("engimusingPartNumber" gin_trgm_ops);',
+            'DROP INDEX mrp_system_part_engi_trgm;'),
+        migrations.RunSQL(
+            'CREATE INDEX mrp_system_manufacturer_partnumber_trgm ON mrp_system_manufacturerrelationship '
+            'USING gin ("partNumber" gin_trgm_ops);',
+            'DROP INDEX mrp_system_manufacturer_partnumber_trgm;'),
+    ]
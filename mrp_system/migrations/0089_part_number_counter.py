@@ -0,0 +1,52 @@
+# Generated by Django 2.1.2 on 2026-10-18 10:13
+
+from django.db import migrations, models
+
+
+def create_counters(apps, schema_editor):
+    """start every prefix's counter at the greatest number used with it, then give
+    parts that were handed a duplicate number a new one so the unique index can be built"""
+    Type = apps.get_model('mrp_system', 'Type')
+    Part = apps.get_model('mrp_system', 'Part')
+    PartNumberCounter = apps.get_model('mrp_system', 'PartNumberCounter')
+    last_numbers = {prefix: 0 for prefix in Type.objects.values_list('prefix', flat=True)}
+    parts = list(Part.objects.select_related('partType').order_by('id'))
+    for part in parts:
+        for prefix in last_numbers:
+            digits = part.engimusingPartNumber[len(prefix):]
+            if (part.engimusingPartNumber.startswith(prefix) and len(digits) == 6
+                    and digits.isdigit()):
+                last_numbers[prefix] = max(last_numbers[prefix], int(digits))
+    seen = set()
+    for part in parts:
+        if part.engimusingPartNumber in seen:
+            prefix = part.partType.prefix
+            last_numbers[prefix] += 1
+            part.engimusingPartNumber = prefix + str(last_numbers[prefix]).zfill(6)
+            part.save(update_fields=['engimusingPartNumber'])
+        seen.add(part.engimusingPartNumber)
+    PartNumberCounter.objects.bulk_create([PartNumberCounter(prefix=prefix, last_number=number)
+                                           for prefix, number in last_numbers.items()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mrp_system', '0088_part_number_trigram'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PartNumberCounter',
+            fields=[
+                ('prefix', models.CharField(max_length=4, primary_key=True, serialize=False)),
+                ('last_number', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_counters, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='part',
+            name='engimusingPartNumber',
+            field=models.CharField(editable=False, max_length=30, unique=True),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 2.1.2 on 2026-10-18 10:14
+
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def set_last_item_numbers(apps, schema_editor):
+    PurchaseOrder = apps.get_model('mrp_system', 'PurchaseOrder')
+    PurchaseOrderParts = apps.get_model('mrp_system', 'PurchaseOrderParts')
+    last = (PurchaseOrderParts.objects.filter(purchase_order=OuterRef('pk'))
+            .values('purchase_order').annotate(last=Max('item_number')).values('last'))
+    PurchaseOrder.objects.update(last_item_number=Coalesce(Subquery(last), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mrp_system', '0089_part_number_counter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PurchaseOrderCounter',
+            fields=[
+                ('date', models.DateField(primary_key=True, serialize=False)),
+                ('last_number', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='purchaseorder',
+            name='last_item_number',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(set_last_item_numbers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.1.2 on 2026-10-18 10:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mrp_system', '0090_purchase_order_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='digikeyapi',
+            name='expires',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
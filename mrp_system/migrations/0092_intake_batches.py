@@ -0,0 +1,37 @@
+# Generated by Django 2.1.2 on 2026-10-18 10:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mrp_system', '0091_digikeyapi_expires'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IntakeBatch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('website', models.CharField(choices=[('Digi-Key', 'Digi-Key'), ('Mouser', 'Mouser')], default='Digi-Key', max_length=10)),
+                ('entry_type', models.CharField(choices=[('barcode', 'Barcodes'), ('partNumber', 'Digi-Key Part Numbers'), ('manuPartNumber', 'Manufacturer Part Numbers')], default='barcode', max_length=15)),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')], default='pending', max_length=10)),
+                ('message', models.CharField(blank=True, max_length=300)),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('date_finished', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='IntakeItem',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('search', models.CharField(max_length=100)),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('found', 'found'), ('created', 'created'), ('exists', 'already exists'), ('not_found', 'not found'), ('error', 'error')], default='pending', max_length=10)),
+                ('message', models.CharField(blank=True, max_length=300)),
+                ('batch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='mrp_system.IntakeBatch')),
+                ('part', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='mrp_system.Part')),
+            ],
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 2.1.2 on 2026-10-18 10:34
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mrp_system', '0092_intake_batches'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task', models.CharField(max_length=200)),
+                ('kwargs', django.contrib.postgres.fields.jsonb.JSONField(default=dict)),
+                ('status', models.CharField(choices=[('queued', 'queued'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')], default='queued', max_length=10)),
+                ('run_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('attempts', models.IntegerField(default=0)),
+                ('max_attempts', models.IntegerField(default=5)),
+                ('last_error', models.TextField(blank=True)),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('date_started', models.DateTimeField(blank=True, null=True)),
+                ('date_finished', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='part',
+            name='datasheet_pending',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['status', 'run_at'], name='mrp_system__status_66641a_idx'),
+        ),
+    ]
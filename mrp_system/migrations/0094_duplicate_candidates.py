@@ -0,0 +1,30 @@
+# Generated by Django 2.1.2 on 2026-10-18 10:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mrp_system', '0093_job_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DuplicateCandidate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('vendor', 'Vendor'), ('location', 'Location'), ('part', 'Part')], max_length=10)),
+                ('primary_id', models.IntegerField()),
+                ('alias_id', models.IntegerField()),
+                ('score', models.FloatField()),
+                ('reason', models.CharField(blank=True, max_length=200)),
+                ('status', models.CharField(choices=[('open', 'open'), ('merged', 'merged'), ('dismissed', 'not a duplicate')], default='open', max_length=10)),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='duplicatecandidate',
+            index=models.Index(fields=['kind', 'status'], name='mrp_system__kind_81afd6_idx'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 2.1.2 on 2026-10-18 11:02
+
+import django.contrib.postgres.fields.jsonb
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+CHAR_FIELDS = ['char%d' % x for x in range(1, 36)]
+
+#blank columns are left out of attributes
+COPY_TO_ATTRIBUTES = 'UPDATE mrp_system_part SET attributes = jsonb_strip_nulls(jsonb_build_object(%s))' % (
+    ', '.join("'%s', NULLIF(%s, '')" % (field, field) for field in CHAR_FIELDS))
+
+COPY_TO_COLUMNS = 'UPDATE mrp_system_part SET %s' % (
+    ', '.join("%s = COALESCE(LEFT(attributes ->> '%s', 100), '')" % (field, field)
+              for field in CHAR_FIELDS))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mrp_system', '0094_duplicate_candidates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='part',
+            name='attributes',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.RunSQL(COPY_TO_ATTRIBUTES, COPY_TO_COLUMNS),
+    ] + [
+        migrations.RemoveField(
+            model_name='part',
+            name=field,
+        ) for field in CHAR_FIELDS
+    ] + [
+        migrations.AlterField(
+            model_name='field',
+            name='fields',
+            field=models.CharField(max_length=50),
+        ),
+        migrations.AddIndex(
+            model_name='part',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['attributes'], name='mrp_system__attribu_750376_gin'),
+        ),
+    ]
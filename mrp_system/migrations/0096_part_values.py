@@ -0,0 +1,32 @@
+# Generated by Django 2.1.2 on 2026-10-18 11:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mrp_system', '0095_part_attributes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PartValue',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.FloatField()),
+                ('unit', models.CharField(blank=True, max_length=10)),
+                ('field', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='mrp_system.Field')),
+                ('part', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='mrp_system.Part')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='partvalue',
+            index=models.Index(fields=['field', 'value'], name='mrp_system__field_i_10e79c_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='partvalue',
+            unique_together={('part', 'field')},
+        ),
+    ]
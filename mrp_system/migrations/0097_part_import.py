@@ -0,0 +1,30 @@
+# Generated by Django 2.1.2 on 2026-10-18 11:05
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mrp_system', '0096_part_values'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PartImport',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.FileField(upload_to='imports/')),
+                ('filename', models.CharField(max_length=255)),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')], default='pending', max_length=10)),
+                ('created', models.IntegerField(default=0)),
+                ('errors', django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=list)),
+                ('message', models.CharField(blank=True, max_length=300)),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('date_finished', models.DateTimeField(blank=True, null=True)),
+                ('partType', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='mrp_system.Type')),
+            ],
+        ),
+    ]
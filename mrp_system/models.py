@@ -1,5 +1,9 @@
-from django.db import models
-import datetime
+from django.db import models, transaction
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.contrib.postgres.fields import JSONField
+from django.utils import timezone
+import datetime, re
 #from django.contrib.sites.models import Site
 
 class Vendor(models.Model):
@@ -35,136 +39,130 @@ class Type(models.Model):
 
 #names of fields for each part type tracked with field model
 class Field(models.Model):
-
-    FIELD_CHOICES = (
-        ('char1', 'Character 1'),
-        ('char2', 'Character 2'),
-        ('char3', 'Character 3'),
-        ('char4', 'Character 4'),
-        ('char5', 'Character 5'),
-        ('char6', 'Character 6'),
-        ('char7', 'Character 7'),
-        ('char8', 'Character 8'),
-        ('char9', 'Character 9'),
-        ('char10', 'Character 10'),
-        ('char11', 'Character 11'),
-        ('char12', 'Character 12'),
-        ('char13', 'Character 13'),
-        ('char14', 'Character 14'),
-        ('char15', 'Character 15'),
-        ('char16', 'Character 16'),
-        ('char17', 'Character 17'),
-        ('char18', 'Character 18'),
-        ('char19', 'Character 19'),
-        ('char20', 'Character 20'),
-        ('char21', 'Character 21'),
-        ('char22', 'Character 22'),
-        ('char23', 'Character 23'),
-        ('char24', 'Character 24'),
-        ('char25', 'Character 25'),
-        ('char26', 'Character 26'),
-        ('char27', 'Character 27'),
-        ('char28', 'Character 28'),
-        ('char29', 'Character 29'),
-        ('char30', 'Character 30'),
-        ('char31', 'Character 31'),
-        ('char32', 'Character 32'),
-        ('char33', 'Character 33'),
-        ('char34', 'Character 34'),
-        ('char35', 'Character 35'),
-    )
     name = models.CharField(max_length=50)
-    fields = models.CharField(max_length=50, choices=FIELD_CHOICES)
+    #key of the field's value in Part.attributes, 'char1', 'char2'...
+    fields = models.CharField(max_length=50)
     typePart = models.ForeignKey(Type, on_delete=models.CASCADE, related_name="field", null=True)
 
 class Part(models.Model):
     #used to keep track of part type and fields
     partType = models.ForeignKey(Type, on_delete=models.CASCADE, related_name="part")
-    engimusingPartNumber = models.CharField(max_length=30, editable=False)
+    engimusingPartNumber = models.CharField(max_length=30, editable=False, unique=True)
     description = models.CharField(max_length=300, blank=True)
     location = models.ManyToManyField(Location, through='LocationRelationship')
     manufacturer = models.ManyToManyField(Vendor,
                                           through='ManufacturerRelationship')
-    #all of the fields that could be tracked for a part type
-    char1 = models.CharField(max_length=100, blank=True)
-    char2 = models.CharField(max_length=100, blank=True)
-    char3 = models.CharField(max_length=100, blank=True)
-    char4 = models.CharField(max_length=100, blank=True)
-    char5 = models.CharField(max_length=100, blank=True)
-    char6 = models.CharField(max_length=100, blank=True)
-    char7 = models.CharField(max_length=100, blank=True)
-    char8 = models.CharField(max_length=100, blank=True)
-    char9 = models.CharField(max_length=100, blank=True)
-    char10 = models.CharField(max_length=100, blank=True)
-    char11 = models.CharField(max_length=100, blank=True)
-    char12 = models.CharField(max_length=100, blank=True)
-    char13 = models.CharField(max_length=100, blank=True)
-    char14 = models.CharField(max_length=100, blank=True)
-    char15 = models.CharField(max_length=100, blank=True)
-    char16 = models.CharField(max_length=100, blank=True)
-    char17 = models.CharField(max_length=100, blank=True)
-    char18 = models.CharField(max_length=100, blank=True)
-    char19 = models.CharField(max_length=100, blank=True)
-    char20 = models.CharField(max_length=100, blank=True)
-    char21 = models.CharField(max_length=100, blank=True)
-    char22 = models.CharField(max_length=100, blank=True)
-    char23 = models.CharField(max_length=100, blank=True)
-    char24 = models.CharField(max_length=100, blank=True)
-    char25 = models.CharField(max_length=100, blank=True)
-    char26 = models.CharField(max_length=100, blank=True)
-    char27 = models.CharField(max_length=100, blank=True)
-    char28 = models.CharField(max_length=100, blank=True)
-    char29 = models.CharField(max_length=100, blank=True)
-    char30 = models.CharField(max_length=100, blank=True)
-    char31 = models.CharField(max_length=100, blank=True)
-    char32 = models.CharField(max_length=100, blank=True)
-    char33 = models.CharField(max_length=100, blank=True)
-    char34 = models.CharField(max_length=100, blank=True)
-    char35 = models.CharField(max_length=100, blank=True)
+    #values of the type's fields as {Field.fields: value}, see attributes.py
+    attributes = JSONField(default=dict, blank=True, editable=False)
     datasheet = models.FileField(upload_to='documents/', blank=True)
+    #set while a job is downloading the datasheet
+    datasheet_pending = models.BooleanField(default=False, editable=False)
+    #total stock over all locations, kept up to date by signals
+    on_hand = models.IntegerField(default=0, editable=False, db_index=True)
+    #part numbers, description, parameters, manufacturers and locations, kept up to date by signals
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        #part list is paged by seeking on part number within a type
+        indexes = [models.Index(fields=['partType', 'engimusingPartNumber', 'id']),
+                   GinIndex(fields=['search_vector']),
+                   GinIndex(fields=['attributes'])]
 
     def __str__(self):
         return '%s - %s' % (self.engimusingPartNumber, self.description)
 
-    #can call these 4 functions from template to get related fields
+    """can call these 4 functions from template to get related fields, they read
+    from the relationship sets so prefetching part_prefetches() saves a query
+    per part in lists"""
     def get_location(self):
-        if self.location:
-            return [LocationRelationship.location.name for LocationRelationship
-                                     in self.locationrelationship_set.order_by('id')]
+        return [LocationRelationship.location.name for LocationRelationship
+                in self.get_stock()]
 
     def get_stock(self):
-        if self.location:
-            return [LocationRelationship for LocationRelationship in
-                    self.locationrelationship_set.order_by('id')]
+        return sorted(self.locationrelationship_set.all(), key=lambda l: l.id)
 
     def get_manufacturers(self):
-        if self.manufacturer:
-            return [manufacturer.name for manufacturer in self.manufacturer.all()]
+        return [ManufacturerRelationship.manufacturer.name for ManufacturerRelationship
+                in self.manufacturerrelationship_set.all()]
 
     def get_related(self):
-        if self.manufacturer:
-            return [str(ManufacturerRelationship.partNumber) for ManufacturerRelationship
-                                      in self.manufacturerrelationship_set.all()] #.objects.get(part=self)])
+        return [str(ManufacturerRelationship.partNumber) for ManufacturerRelationship
+                in self.manufacturerrelationship_set.all()]
+
+    #value of one of the type's fields by its Field.fields key, blank if it isn't set
+    def get_attribute(self, key):
+        return self.attributes.get(key, '')
+
+    def set_attribute(self, key, value):
+        if value:
+            self.attributes[key] = value
+        else:
+            self.attributes.pop(key, None)
 
     #auto assign engimusingPartNumber with prefix and auto incremented number
     def save(self, *args, **kwargs):
         if not self.id:
-            partType = self.partType
-            self.engimusingPartNumber = increment_engi_partnumber(partType)
-        super().save(*args, **kwargs)
+            #counter row stays locked until the part is saved, a failed save doesn't use up the number
+            with transaction.atomic():
+                self.engimusingPartNumber = increment_engi_partnumber(self.partType)
+                super().save(*args, **kwargs)
+        else:
+            super().save(*args, **kwargs)
+
+#pass to prefetch_related, lookup is the path to the part eg. 'part__'
+def part_prefetches(lookup=''):
+    return [models.Prefetch(lookup + 'locationrelationship_set',
+                            queryset=LocationRelationship.objects.select_related('location')),
+            models.Prefetch(lookup + 'manufacturerrelationship_set',
+                            queryset=ManufacturerRelationship.objects.select_related('manufacturer'))]
+
+"""numeric value of one of a part's fields, parsed from its text ("10kOhms" is
+10000 Ohm) by parametric.py so the part list can filter by range and find the
+nearest value through the (field, value) index. Kept up to date by signals"""
+class PartValue(models.Model):
+    part = models.ForeignKey(Part, on_delete=models.CASCADE)
+    field = models.ForeignKey(Field, on_delete=models.CASCADE)
+    #in the unit without a prefix, eg. farads rather than nF
+    value = models.FloatField()
+    unit = models.CharField(max_length=10, blank=True)
+
+    class Meta:
+        unique_together = ('part', 'field')
+        indexes = [models.Index(fields=['field', 'value'])]
+
+#last engimusingPartNumber handed out for each prefix, see allocate_engi_partnumbers.
+#kept per prefix rather than per type since types can share a prefix
+class PartNumberCounter(models.Model):
+    prefix = models.CharField(max_length=4, primary_key=True)
+    last_number = models.IntegerField(default=0)
+
+def format_engi_partnumber(prefix, number):
+    return prefix + str(number).zfill(6)
+
+def last_engi_partnumber(prefix):
+    #greatest number used with a prefix, only used to start its counter
+    last_id = (Part.objects.filter(engimusingPartNumber__regex=r'^%s[0-9]{6}$' % re.escape(prefix))
+               .order_by('engimusingPartNumber').last())
+    if not last_id:
+        return 0
+    return int(last_id.engimusingPartNumber[len(prefix):])
 
-def increment_engi_partnumber(partType):
-    #get greatest part number
-    last_id = Part.objects.filter(partType=partType).order_by('engimusingPartNumber').last()
+def allocate_engi_partnumbers(partType, count):
+    """reserve count new part numbers for a type. The prefix's counter row is
+    locked until the surrounding transaction ends, so concurrent creates and
+    imports never get the same number"""
     prefix = partType.prefix
-    #if no parts yet
-    if not last_id:
-        return prefix + '000001'
-    length = len(prefix)
-    partNumber = int(last_id.engimusingPartNumber[length:10])
-    new_partNumber = partNumber + 1
-    new_engi_partNumber = prefix + str(new_partNumber).zfill(6)
-    return new_engi_partNumber
+    with transaction.atomic():
+        counter, created = (PartNumberCounter.objects.select_for_update()
+                            .get_or_create(prefix=prefix,
+                                           defaults={'last_number': lambda: last_engi_partnumber(prefix)}))
+        first = counter.last_number + 1
+        counter.last_number += count
+        counter.save(update_fields=['last_number'])
+    return [format_engi_partnumber(prefix, number) for number in range(first, first + count)]
+
+def increment_engi_partnumber(partType):
+    return allocate_engi_partnumbers(partType, 1)[0]
 
 class ManufacturerRelationship(models.Model):
     part = models.ForeignKey(Part, on_delete=models.CASCADE)
@@ -187,14 +185,15 @@ class Product(models.Model):
     component_product = models.ManyToManyField('self', symmetrical=False,
                                                through='ProductAmount',
                                                through_fields=('from_product', 'to_product'),)
+    #total stock over all locations, kept up to date by signals
+    on_hand = models.IntegerField(default=0, editable=False, db_index=True)
 
     def __str__(self):
         return str(self.description)
 
     def get_stock(self):
-        if self.location:
-            return [ProductLocation for ProductLocation in
-                    self.productlocation_set.order_by('id')]
+        #reads productlocation_set so it can be prefetched
+        return sorted(self.productlocation_set.all(), key=lambda l: l.id)
 
 class PartAmount(models.Model):
     part = models.ForeignKey(Part, on_delete=models.CASCADE)
@@ -216,6 +215,8 @@ class ManufacturingOrder(models.Model):
     product = models.ManyToManyField(Product, through='MOProduct')
     number = models.CharField(max_length=50)
     date_created = models.DateTimeField(auto_now_add=True)
+    #completed orders are left out of the mrp run
+    completed = models.BooleanField(default=False)
 
     def __str__(self):
         return self.number
@@ -225,32 +226,60 @@ class MOProduct(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     amount = models.IntegerField(blank=True, null=True)
 
+#last purchase order number handed out each day, see allocate_po_number
+class PurchaseOrderCounter(models.Model):
+    date = models.DateField(primary_key=True)
+    last_number = models.IntegerField(default=0)
+
+def last_po_number(date):
+    #greatest number used on a day, only used to start its counter
+    last_id = (PurchaseOrder.objects.filter(number__startswith='PO%s_' % date)
+               .order_by('number').last())
+    if not last_id:
+        return 0
+    return int(str(last_id.number)[13:16])
+
+def allocate_po_number():
+    """next purchase order number for today, the day's counter row is locked
+    until the surrounding transaction ends so concurrent orders never share one"""
+    today = datetime.datetime.now().date()
+    with transaction.atomic():
+        counter, created = (PurchaseOrderCounter.objects.select_for_update()
+                            .get_or_create(date=today,
+                                           defaults={'last_number': lambda: last_po_number(today)}))
+        counter.last_number += 1
+        counter.save(update_fields=['last_number'])
+    return "PO%s_%s" % (today, str(counter.last_number).zfill(2))
+
 class PurchaseOrder(models.Model):
     number = models.CharField(max_length=20, editable=False)
     vendor = models.ForeignKey(Vendor, on_delete=models.CASCADE, null=True)
     part = models.ManyToManyField(Part, through='PurchaseOrderParts')
+    #parts on purchase orders that haven't been received count as on order in the mrp run
+    received = models.BooleanField(default=False)
+    #last item_number given to one of its lines, see allocate_item_numbers
+    last_item_number = models.IntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.number
     
     def save(self, *args, **kwargs):
         if not self.id:
-            last_id = PurchaseOrder.objects.order_by('number').last()
-            today = str(datetime.datetime.now().date())
-            new_number = "PO" + today
-            if last_id:
-                str_number = str(last_id.number)
-                last_date = str_number[2:12]
-                if last_date == today:
-                    nn = int(str_number[13:16]) + 1
-                else:
-                    nn = 1
-            else:
-                nn = 1
-            new_number += "_" + str(nn).zfill(2)
-            self.number = new_number
-        super().save(*args, **kwargs)
-
+            with transaction.atomic():
+                self.number = allocate_po_number()
+                super().save(*args, **kwargs)
+        else:
+            super().save(*args, **kwargs)
+
+def allocate_item_numbers(purchase_order, count):
+    """reserve count line numbers on a purchase order, the order's row stays
+    locked by the UPDATE until the surrounding transaction ends"""
+    with transaction.atomic():
+        PurchaseOrder.objects.filter(id=purchase_order.id).update(
+            last_item_number=models.F('last_item_number') + count)
+        last = PurchaseOrder.objects.filter(id=purchase_order.id).values_list(
+            'last_item_number', flat=True).get()
+    return list(range(last - count + 1, last + 1))
 
 class PurchaseOrderParts(models.Model):
     part = models.ForeignKey(Part, on_delete=models.CASCADE)
@@ -260,18 +289,43 @@ class PurchaseOrderParts(models.Model):
     total = models.DecimalField(max_digits=6, decimal_places=2, editable=False, blank=True, null=True)
     item_number = models.IntegerField(editable=False, default=0)
 
-    def save(self, *args, **kwargs):
-        if not self.id:
-            last_id = PurchaseOrderParts.objects.filter(purchase_order=self.purchase_order).order_by('item_number').last()
-            if not last_id:
-                self.item_number = 1
-            else:
-                self.item_number = last_id.item_number + 1
+    def calculate_total(self):
         if self.unit_price and self.quantity:
             self.total = self.unit_price * self.quantity
         else:
             self.total = 0
-        super().save(*args, **kwargs)
+
+    def save(self, *args, **kwargs):
+        self.calculate_total()
+        if not self.id:
+            with transaction.atomic():
+                self.item_number = allocate_item_numbers(self.purchase_order, 1)[0]
+                super().save(*args, **kwargs)
+        else:
+            super().save(*args, **kwargs)
+
+def insert_po_lines(lines):
+    #bulk_create doesn't send the signals that tell the mrp run about new orders, record them here
+    lines = PurchaseOrderParts.objects.bulk_create(lines)
+    PlanningChange.objects.bulk_create([PlanningChange(part_id=line.part_id) for line in lines])
+    return lines
+
+#combined requirements of all open manufacturing orders, saved by the mrp run
+class PlannedRequirement(models.Model):
+    part = models.OneToOneField(Part, on_delete=models.CASCADE, null=True, blank=True)
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, null=True, blank=True)
+    gross = models.IntegerField(default=0)
+    on_hand = models.IntegerField(default=0)
+    on_order = models.IntegerField(default=0)
+    net = models.IntegerField(default=0)
+    date_planned = models.DateTimeField(auto_now=True)
+
+"""anything that changed since the last mrp run, saved by signals. part_id is the
+part whose stock or orders changed, or null if demand (orders, BOMs) changed.
+not a foreign key so deleted parts can still be recorded"""
+class PlanningChange(models.Model):
+    part_id = models.IntegerField(null=True, blank=True)
+    date_created = models.DateTimeField(auto_now_add=True)
 
 """used to keep track of tokens, only one instance of this model named "DigiKey",
 don't create another instance of this as it can mess up the tokens"""
@@ -279,4 +333,129 @@ class DigiKeyAPI(models.Model):
     name = models.CharField(max_length=100)
     refresh_token = models.CharField(max_length=150)
     access_token = models.CharField(max_length=150)
+    #when access_token runs out, it's refreshed after this
+    expires = models.DateTimeField(null=True, blank=True)
+
+"""barcodes or part numbers looked up on digikey together, e.g. every reel of a
+shipment. The parts are created by mrp_system.intake in the background"""
+class IntakeBatch(models.Model):
+    WEBSITE_CHOICES = (
+        ('Digi-Key', 'Digi-Key'),
+        ('Mouser', 'Mouser'),
+        )
+    ENTRY_CHOICES = (
+        ('barcode', 'Barcodes'),
+        ('partNumber', 'Digi-Key Part Numbers'),
+        ('manuPartNumber', 'Manufacturer Part Numbers'),
+        )
+    STATUS_CHOICES = (
+        ('pending', 'pending'),
+        ('running', 'running'),
+        ('done', 'done'),
+        ('failed', 'failed'),
+        )
+    website = models.CharField(max_length=10, choices=WEBSITE_CHOICES, default='Digi-Key')
+    entry_type = models.CharField(max_length=15, choices=ENTRY_CHOICES, default='barcode')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    message = models.CharField(max_length=300, blank=True)
+    date_created = models.DateTimeField(auto_now_add=True)
+    date_finished = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return 'Intake %d' % self.id
+
+#one entered barcode or part number of a batch and what came of it
+class IntakeItem(models.Model):
+    STATUS_CHOICES = (
+        ('pending', 'pending'),
+        ('found', 'found'),
+        ('created', 'created'),
+        ('exists', 'already exists'),
+        ('not_found', 'not found'),
+        ('error', 'error'),
+        )
+    batch = models.ForeignKey(IntakeBatch, on_delete=models.CASCADE, related_name='items')
+    search = models.CharField(max_length=100)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    message = models.CharField(max_length=300, blank=True)
+    part = models.ForeignKey(Part, on_delete=models.SET_NULL, null=True, blank=True)
     
+
+"""an uploaded csv or xlsx file of parts, imported by a job so big files
+don't hold up the web request. errors are [row number, message] of the rows
+that were skipped"""
+class PartImport(models.Model):
+    STATUS_CHOICES = (
+        ('pending', 'pending'),
+        ('running', 'running'),
+        ('done', 'done'),
+        ('failed', 'failed'),
+        )
+    partType = models.ForeignKey(Type, on_delete=models.CASCADE)
+    file = models.FileField(upload_to='imports/')
+    filename = models.CharField(max_length=255)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    created = models.IntegerField(default=0)
+    errors = JSONField(default=list, blank=True)
+    message = models.CharField(max_length=300, blank=True)
+    date_created = models.DateTimeField(auto_now_add=True)
+    date_finished = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.filename
+
+"""two vendors, locations or parts that look like the same thing, found by
+find_duplicates and reviewed on the duplicates page. Ids rather than foreign
+keys since they point at different models"""
+class DuplicateCandidate(models.Model):
+    KIND_CHOICES = (
+        ('vendor', 'Vendor'),
+        ('location', 'Location'),
+        ('part', 'Part'),
+        )
+    STATUS_CHOICES = (
+        ('open', 'open'),
+        ('merged', 'merged'),
+        ('dismissed', 'not a duplicate'),
+        )
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    #the one kept if they're merged
+    primary_id = models.IntegerField()
+    alias_id = models.IntegerField()
+    score = models.FloatField()
+    reason = models.CharField(max_length=200, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='open')
+    date_created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['kind', 'status'])]
+
+"""slow work (datasheet downloads, batch lookups) done by the run_jobs worker
+instead of in the request. task is the dotted path of a function that's
+called with kwargs, see mrp_system.jobs"""
+class Job(models.Model):
+    STATUS_CHOICES = (
+        ('queued', 'queued'),
+        ('running', 'running'),
+        ('done', 'done'),
+        ('failed', 'failed'),
+        )
+    task = models.CharField(max_length=200)
+    kwargs = JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    #not picked up before this, pushed back after each failed attempt
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+    last_error = models.TextField(blank=True)
+    date_created = models.DateTimeField(auto_now_add=True)
+    #touched every so often by the worker running it, see jobs.Heartbeat
+    date_started = models.DateTimeField(null=True, blank=True)
+    date_finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        #workers look for the next queued job that's due
+        indexes = [models.Index(fields=['status', 'run_at'])]
+
+    def __str__(self):
+        return '%s %s' % (self.task, self.kwargs)
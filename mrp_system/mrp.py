@@ -0,0 +1,197 @@
+from collections import defaultdict
+from django.db import connection, transaction
+from django.db.models import Sum, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from mrp_system.bom import BOMGraph
+from mrp_system.models import (Part, Product, LocationRelationship, ProductLocation, MOProduct,
+                               ManufacturingOrder, PurchaseOrderParts,
+                               PlannedRequirement, PlanningChange, PurchaseOrder,
+                               insert_po_lines)
+
+#advisory lock held while shortages are ordered so two requests can't order them both
+ORDER_SHORTAGES_LOCK = 7401
+
+class Requirement(object):
+    """gross amount needed, what's on hand or already ordered and the net
+    amount still to be made or ordered"""
+
+    def __init__(self, gross, on_hand, on_order=0):
+        self.gross = gross
+        self.on_hand = on_hand
+        self.on_order = on_order
+        self.net = max(gross - on_hand - on_order, 0)
+
+def get_part_stock(part_ids):
+    #total stock of each part over all locations
+    return dict(Part.objects.filter(id__in=part_ids).values_list('id', 'on_hand'))
+
+def get_product_stock(product_ids):
+    return dict(Product.objects.filter(id__in=product_ids).values_list('id', 'on_hand'))
+
+def update_part_stock(part_ids=None):
+    """recalculate Part.on_hand from LocationRelationship stock in one UPDATE,
+    for every part if part_ids isn't given"""
+    totals = (LocationRelationship.objects.filter(part=OuterRef('pk'))
+              .values('part').annotate(total=Sum('stock')).values('total'))
+    parts = Part.objects.all() if part_ids is None else Part.objects.filter(id__in=part_ids)
+    return parts.update(on_hand=Coalesce(Subquery(totals), 0))
+
+def update_product_stock(product_ids=None):
+    totals = (ProductLocation.objects.filter(product=OuterRef('pk'))
+              .values('product').annotate(total=Sum('stock')).values('total'))
+    products = Product.objects.all() if product_ids is None else Product.objects.filter(id__in=product_ids)
+    return products.update(on_hand=Coalesce(Subquery(totals), 0))
+
+def get_part_on_order(part_ids):
+    #parts on purchase orders that haven't been received yet
+    rows = (PurchaseOrderParts.objects.filter(part_id__in=part_ids, purchase_order__received=False)
+            .values('part_id').annotate(total=Sum('quantity')))
+    return {row['part_id']: row['total'] or 0 for row in rows}
+
+def plan_requirements(manufacturing_orders, on_order=False):
+    """fully explode the products of the manufacturing orders and net them
+    against stock, returns ({part: Requirement}, {sub product: Requirement}).
+    Sub products are netted before being broken down so parts are only needed
+    for the sub products that aren't already in stock. If on_order is set parts
+    on open purchase orders are netted as well"""
+    quantities = defaultdict(int)
+    for m in MOProduct.objects.filter(manufacturing_order__in=manufacturing_orders):
+        quantities[m.product_id] += m.amount or 0
+    graph = BOMGraph(quantities.keys())
+    #parents always come first so a sub product has all of its demand before it's netted
+    order = graph.topological_order(quantities.keys())
+    product_stock = get_product_stock(order)
+    demand = defaultdict(int)
+    product_requirements = {}
+    part_gross = defaultdict(int)
+    for product_id in order:
+        if demand[product_id]:
+            requirement = Requirement(demand[product_id], product_stock.get(product_id, 0))
+            product_requirements[graph.products[product_id]] = requirement
+            to_build = requirement.net
+        else:
+            to_build = 0
+        #products on the manufacturing order are built regardless of stock
+        to_build += quantities.get(product_id, 0)
+        for part_id, amount in graph.parts[product_id]:
+            part_gross[part_id] += amount * to_build
+        for to_id, amount in graph.children[product_id]:
+            demand[to_id] += amount * to_build
+    part_stock = get_part_stock(part_gross.keys())
+    part_on_order = get_part_on_order(part_gross.keys()) if on_order else {}
+    part_requirements = {}
+    for part_id, gross in part_gross.items():
+        part_requirements[graph.part_objects[part_id]] = Requirement(
+            gross, part_stock.get(part_id, 0), part_on_order.get(part_id, 0))
+    return part_requirements, product_requirements
+
+def run_mrp(full=False):
+    """net the combined demand of every open manufacturing order against stock and
+    open purchase orders and save it as PlannedRequirements. If demand hasn't
+    changed since the last run only the parts whose stock or orders changed are
+    recomputed, returns the number of requirements saved"""
+    last_change = PlanningChange.objects.order_by('id').last()
+    if last_change:
+        #changes made while running are left for the next run
+        changes = PlanningChange.objects.filter(id__lte=last_change.id)
+    else:
+        changes = PlanningChange.objects.none()
+    part_ids = set(changes.values_list('part_id', flat=True))
+    if full or None in part_ids or not PlannedRequirement.objects.exists():
+        saved = _plan_all()
+    else:
+        saved = _plan_parts(part_ids)
+    changes.delete()
+    return saved
+
+def _plan_all():
+    open_orders = ManufacturingOrder.objects.filter(completed=False)
+    parts, products = plan_requirements(open_orders, on_order=True)
+    requirements = {}
+    for part, requirement in parts.items():
+        requirements[(part.id, None)] = requirement
+    for product, requirement in products.items():
+        requirements[(None, product.id)] = requirement
+    existing = {(row.part_id, row.product_id): row for row in PlannedRequirement.objects.all()}
+    saved = _save_plan(requirements, existing)
+    #anything left isn't needed by an open order anymore
+    PlannedRequirement.objects.filter(id__in=[row.id for row in existing.values()]).delete()
+    return saved
+
+def _plan_parts(part_ids):
+    #demand is unchanged, so only stock and orders need to be looked up again
+    existing = {(row.part_id, None): row for row in
+                PlannedRequirement.objects.filter(part_id__in=part_ids)}
+    ids = [part_id for part_id, product_id in existing]
+    stock = get_part_stock(ids)
+    on_order = get_part_on_order(ids)
+    requirements = {}
+    for key, row in existing.items():
+        requirements[key] = Requirement(row.gross, stock.get(key[0], 0), on_order.get(key[0], 0))
+    return _save_plan(requirements, existing)
+
+def _save_plan(requirements, existing):
+    #only rows whose numbers changed are written, matched rows are removed from existing
+    new_rows = []
+    saved = 0
+    for key, requirement in requirements.items():
+        values = {'gross': requirement.gross, 'on_hand': requirement.on_hand,
+                  'on_order': requirement.on_order, 'net': requirement.net}
+        row = existing.pop(key, None)
+        if row is None:
+            new_rows.append(PlannedRequirement(part_id=key[0], product_id=key[1], **values))
+        elif any(getattr(row, field) != value for field, value in values.items()):
+            for field, value in values.items():
+                setattr(row, field, value)
+            row.save()
+            saved += 1
+    PlannedRequirement.objects.bulk_create(new_rows)
+    return saved + len(new_rows)
+
+def get_last_orders(part_ids):
+    """{part_id: (vendor_id, unit_price)} from the last purchase order each part
+    was ordered on with a vendor, used as the part's preferred vendor"""
+    lines = (PurchaseOrderParts.objects
+             .filter(part_id__in=part_ids, purchase_order__vendor__isnull=False)
+             .order_by('part_id', '-purchase_order_id').distinct('part_id')
+             .values_list('part_id', 'purchase_order__vendor_id', 'unit_price'))
+    return {part_id: (vendor_id, unit_price) for part_id, vendor_id, unit_price in lines}
+
+def generate_purchase_orders(quantities):
+    """create one purchase order per preferred vendor for {part_id: quantity},
+    parts that have never been ordered from a vendor go on an order without one.
+    Every line is inserted at once in a single transaction, returns the orders"""
+    last_orders = get_last_orders(quantities.keys())
+    vendor_parts = defaultdict(list)
+    for part_id in sorted(quantities):
+        vendor_id, unit_price = last_orders.get(part_id, (None, None))
+        vendor_parts[vendor_id].append((part_id, unit_price))
+    purchase_orders = []
+    lines = []
+    with transaction.atomic():
+        for vendor_id, part_prices in vendor_parts.items():
+            #new orders so lines are numbered from 1 without going through allocate_item_numbers
+            po = PurchaseOrder.objects.create(vendor_id=vendor_id,
+                                              last_item_number=len(part_prices))
+            purchase_orders.append(po)
+            for item_number, (part_id, unit_price) in enumerate(part_prices, 1):
+                line = PurchaseOrderParts(purchase_order=po, part_id=part_id,
+                                          quantity=quantities[part_id],
+                                          unit_price=unit_price, item_number=item_number)
+                line.calculate_total()
+                lines.append(line)
+        insert_po_lines(lines)
+    return purchase_orders
+
+def order_shortages():
+    """run the mrp so the plan is up to date, then order every part that's
+    still short from its preferred vendor. Returns the orders, [] if nothing
+    is short. The orders count as on order in the next run so ordering again
+    straight away finds nothing"""
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [ORDER_SHORTAGES_LOCK])
+        run_mrp()
+        quantities = dict(PlannedRequirement.objects.filter(part__isnull=False, net__gt=0)
+                          .values_list('part_id', 'net'))
+        return generate_purchase_orders(quantities) if quantities else []
@@ -0,0 +1,70 @@
+from django.db.models import Q
+
+#page size choices shown in lists
+PAGE_SIZES = [25, 50, 100, 250]
+DEFAULT_PAGE_SIZE = 50
+
+class KeysetPage(object):
+    """one page of a keyset paginated list, cursors are passed back as the
+    after/before GET parameters to get the next/previous page"""
+
+    def __init__(self, object_list, page_size, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.page_size = page_size
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+def get_page_size(request):
+    try:
+        page_size = int(request.GET.get('page_size', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return DEFAULT_PAGE_SIZE
+    if page_size not in PAGE_SIZES:
+        return DEFAULT_PAGE_SIZE
+    return page_size
+
+def parse_cursor(value):
+    #cursor is "<value of field>,<id>" of the row to page from, id always comes last
+    try:
+        field_value, pk = value.rsplit(',', 1)
+        return field_value, int(pk)
+    except (AttributeError, ValueError):
+        return None
+
+def keyset_page(queryset, request, field, descending=False):
+    """page through queryset ordered by (field, id) by seeking past the last row
+    shown instead of using OFFSET, so every page costs the same however deep it is
+    and rows added or removed don't shift later pages"""
+    page_size = get_page_size(request)
+    after = parse_cursor(request.GET.get('after'))
+    before = parse_cursor(request.GET.get('before'))
+    forward, backward = ('lt', 'gt') if descending else ('gt', 'lt')
+    order = ('-' + field, '-id') if descending else (field, 'id')
+    reverse_order = (field, 'id') if descending else ('-' + field, '-id')
+    if before:
+        value, pk = before
+        rows = list(queryset.filter(Q(**{field + '__' + backward: value}) |
+                                    Q(**{field: value, 'id__' + backward: pk}))
+                    .order_by(*reverse_order)[:page_size + 1])
+        has_previous = len(rows) > page_size
+        rows = rows[:page_size][::-1]
+        has_next = True
+    else:
+        if after:
+            value, pk = after
+            queryset = queryset.filter(Q(**{field + '__' + forward: value}) |
+                                       Q(**{field: value, 'id__' + forward: pk}))
+        rows = list(queryset.order_by(*order)[:page_size + 1])
+        has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        has_previous = after is not None
+    cursor = lambda row: '%s,%d' % (getattr(row, field), row.id)
+    next_cursor = cursor(rows[-1]) if rows and has_next else None
+    previous_cursor = cursor(rows[0]) if rows and has_previous else None
+    return KeysetPage(rows, page_size, next_cursor, previous_cursor)
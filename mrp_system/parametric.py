@@ -0,0 +1,183 @@
+import math, re
+from collections import defaultdict
+from django.db import transaction
+from django.db.models import Q, Func, Value, FloatField, OuterRef, Subquery
+from mrp_system.models import Part, Field, PartValue
+from mrp_system.facets import invalidate_facets
+
+"""numeric index of part parameters. Values like "10kOhms", "0.1µF" or "25 V"
+are parsed into PartValue rows in their base unit so the part list can ask
+for a range ("90nF to 110nF") or the nearest value through the (field, value)
+index instead of comparing text"""
+
+SI_PREFIXES = {'p': 1e-12, 'n': 1e-9, 'u': 1e-6, 'µ': 1e-6, 'μ': 1e-6, 'm': 1e-3,
+               'k': 1e3, 'K': 1e3, 'M': 1e6, 'G': 1e9, 'T': 1e12}
+#units a prefix can go in front of, by their lower case spelling. Anything
+#else after the number (%, ppm, °C...) is kept as the unit as it's written
+UNITS = {'ohm': 'Ohm', 'ohms': 'Ohm', 'Ω': 'Ohm', 'f': 'F', 'v': 'V', 'a': 'A', 'w': 'W',
+         'hz': 'Hz', 'h': 'H'}
+#prefixes used when showing a value, largest first
+DISPLAY_PREFIXES = [('T', 1e12), ('G', 1e9), ('M', 1e6), ('k', 1e3), ('', 1),
+                    ('m', 1e-3), ('µ', 1e-6), ('n', 1e-9), ('p', 1e-12)]
+
+#catalogs written in capitals (100PF, 10UF) mean the small prefixes, only
+#used when one of UNITS follows in capitals too, so 10 Pa stays pascals
+CAPITAL_PREFIXES = {'P': 'p', 'N': 'n', 'U': 'u'}
+
+#a number with a leading zero like 0402 is a code (package size), not a
+#quantity. The unit starts with a letter or %, so fractions like 1/4W and
+#units with a / in them aren't read
+QUANTITY_RE = re.compile(r'^([+-]?(?:(?:0|[1-9]\d*)(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?)\s*((?:[^\W\d_]|[%°])[^\s/]*)?$')
+#'0.25W, 1/4W' lists the same value more than one way
+ALTERNATIVES_RE = re.compile(r',\s')
+
+#parts are indexed this many at a time by index_part_values
+INDEX_BATCH_SIZE = 2000
+#nearest value searches look at most this many values either side of the target
+NEAREST_LIMIT = 250
+
+def parse_quantity(text):
+    """(value in the base unit, unit) for text like '10kOhms', '0.1µF' or
+    '±5%', None if it isn't a single number with an optional prefix and unit.
+    Only the first of a list of alternatives ('0.25W, 1/4W') is read"""
+    text = ALTERNATIVES_RE.split(str(text))[0]
+    match = QUANTITY_RE.match(text.strip().lstrip('±').strip())
+    if match is None:
+        return None
+    number, suffix = match.groups()
+    suffix = suffix or ''
+    value = float(number)
+    prefix, rest = suffix[:1], suffix[1:]
+    unit = UNITS.get(suffix.lower())
+    if unit is None and prefix in SI_PREFIXES:
+        unit = UNITS.get(rest.lower()) if rest else ''
+        if unit is not None:
+            value *= SI_PREFIXES[prefix]
+    if unit is None and prefix in CAPITAL_PREFIXES and rest.isupper() and rest.lower() in UNITS:
+        unit = UNITS[rest.lower()]
+        value *= SI_PREFIXES[CAPITAL_PREFIXES[prefix]]
+    if unit is None:
+        unit = suffix
+    #so 100nF and 0.1µF come out the same
+    value = float('%.12g' % value)
+    if not math.isfinite(value) or len(unit) > PartValue._meta.get_field('unit').max_length:
+        return None
+    return value, unit
+
+def format_quantity(value, unit=''):
+    #10000.0, 'Ohm' -> '10kOhm', units that don't take a prefix are shown as they are
+    if value == 0 or (unit and unit not in UNITS.values()):
+        return '%g%s' % (value, unit)
+    for prefix, scale in DISPLAY_PREFIXES:
+        if abs(value) >= scale:
+            break
+    return '%g%s%s' % (value / scale, prefix, unit)
+
+def format_range(low, high, unit=''):
+    #'90nF to 110nF', 'at least 25V' or 'at most 1A'
+    if low is None:
+        return 'at most %s' % format_quantity(high, unit)
+    if high is None:
+        return 'at least %s' % format_quantity(low, unit)
+    return '%s to %s' % (format_quantity(low, unit), format_quantity(high, unit))
+
+def part_values(part_id, attributes, fields):
+    #PartValue rows for the attributes of a part whose value is a number, fields are its type's
+    rows = []
+    for field in fields:
+        quantity = parse_quantity(attributes.get(field.fields, ''))
+        if quantity is not None:
+            rows.append(PartValue(part_id=part_id, field=field, value=quantity[0], unit=quantity[1]))
+    return rows
+
+def update_part_values(part_ids):
+    """index the numeric values of the given parts again, with one delete and
+    one insert. Used by the part signal and after parts are bulk created"""
+    parts = list(Part.objects.filter(id__in=list(part_ids))
+                 .values_list('id', 'partType_id', 'attributes'))
+    fields = defaultdict(list)
+    for field in Field.objects.filter(typePart_id__in=set(type_id for part_id, type_id, attributes in parts)):
+        fields[field.typePart_id].append(field)
+    rows = []
+    for part_id, type_id, attributes in parts:
+        rows += part_values(part_id, attributes, fields[type_id])
+    with transaction.atomic():
+        PartValue.objects.filter(part_id__in=[part[0] for part in parts]).delete()
+        PartValue.objects.bulk_create(rows)
+    return len(rows)
+
+def index_part_values(type_id=None, batch_size=INDEX_BATCH_SIZE):
+    #index every part (of a type), returns the number of values indexed
+    parts = Part.objects.order_by('id')
+    if type_id is not None:
+        parts = parts.filter(partType_id=type_id)
+    count = 0
+    last_id = 0
+    while True:
+        part_ids = list(parts.filter(id__gt=last_id).values_list('id', flat=True)[:batch_size])
+        if not part_ids:
+            return count
+        count += update_part_values(part_ids)
+        last_id = part_ids[-1]
+
+def index_type_values(type_id):
+    #job run when a type's fields change, their values may now come from other keys
+    index_part_values(type_id)
+    invalidate_facets([type_id])
+
+def parse_range(low, high):
+    """(low, high, unit) from the text of a range filter, either end can be
+    left blank (None). The unit typed with either end, if any, has to match.
+    None if neither end can be read as a number or the units differ"""
+    low = parse_quantity(low) if low else None
+    high = parse_quantity(high) if high else None
+    if low is None and high is None:
+        return None
+    units = set(quantity[1] for quantity in (low, high) if quantity and quantity[1])
+    if len(units) > 1:
+        return None
+    return low[0] if low else None, high[0] if high else None, units.pop() if units else ''
+
+def range_filters(params, fields):
+    """{Field: (low, high, unit)} from the <key>__min and <key>__max GET
+    parameters, fields are the type's Field rows"""
+    ranges = {}
+    for field in fields:
+        value_range = parse_range(params.get(field.fields + '__min'), params.get(field.fields + '__max'))
+        if value_range is not None:
+            ranges[field] = value_range
+    return ranges
+
+def nearest_filter(params, fields):
+    #(Field, target, unit) from the near_field and near GET parameters, or None
+    quantity = parse_quantity(params['near']) if params.get('near') else None
+    for field in fields:
+        if quantity is not None and field.fields == params.get('near_field'):
+            return field, quantity[0], quantity[1]
+    return None
+
+def field_values(field_id, unit=''):
+    values = PartValue.objects.filter(field_id=field_id)
+    return values.filter(unit=unit) if unit else values
+
+def range_filter(field_id, low=None, high=None, unit=''):
+    #Q for parts whose value of a field is between low and high (both included), through the index
+    values = field_values(field_id, unit)
+    if low is not None:
+        values = values.filter(value__gte=low)
+    if high is not None:
+        values = values.filter(value__lte=high)
+    return Q(id__in=values.values('part_id'))
+
+def nearest_parts(parts, field_id, target, unit='', limit=NEAREST_LIMIT):
+    """parts with a value of a field close to target, annotated with distance
+    (how far from target it is). Only the limit closest values above and below
+    target among parts are considered, each side is one scan of the index"""
+    values = field_values(field_id, unit).filter(part_id__in=parts.order_by().values('id'))
+    below = values.filter(value__lte=target).order_by('-value').values_list('part_id', flat=True)[:limit]
+    above = values.filter(value__gt=target).order_by('value').values_list('part_id', flat=True)[:limit]
+    value = Subquery(PartValue.objects.filter(part=OuterRef('pk'), field_id=field_id).values('value'),
+                     output_field=FloatField())
+    return (parts.filter(id__in=list(below) + list(above))
+            .annotate(distance=Func(value, Value(target), template='ABS(%(expressions)s)',
+                                    arg_joiner=' - ', output_field=FloatField())))
@@ -0,0 +1,124 @@
+import hashlib
+from django.contrib.postgres.aggregates import StringAgg
+from django.core.cache import cache
+from django.contrib.postgres.search import (SearchVector, SearchQuery, SearchRank,
+                                           TrigramSimilarity)
+from django.db.models import (F, Q, Case, When, Value, CharField, FloatField, Lookup,
+                              OuterRef, Subquery)
+from django.db.models.functions import Cast, Coalesce, Greatest
+from mrp_system.models import (Part, Type, ManufacturerRelationship,
+                               LocationRelationship)
+from mrp_system.attributes import attribute_text
+
+#part pickers only search once this many characters are typed and show the best TYPEAHEAD_LIMIT
+TYPEAHEAD_MIN_LENGTH = 2
+TYPEAHEAD_LIMIT = 25
+#short so new parts show up in pickers quickly without any invalidation
+TYPEAHEAD_CACHE_TIMEOUT = 60
+
+SEARCH_MODES = [('', 'Auto'), ('text', 'Words'), ('number', 'Part number')]
+#trgm_similar is pg_trgm's % operator, a match means similarity above
+#pg_trgm.similarity_threshold (0.3 by default). Both lookups compare the bare column so the gin_trgm_ops indexes on
+#engimusingPartNumber and partNumber can be used, icontains wraps the column in UPPER()
+@CharField.register_lookup
+class TrigramSimilar(Lookup):
+    lookup_name = 'trgm_similar'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return '%s %%%% %s' % (lhs, rhs), lhs_params + rhs_params
+
+@CharField.register_lookup
+class TrigramContains(Lookup):
+    lookup_name = 'trgm_contains'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        rhs_params = ['%%%s%%' % connection.ops.prep_for_like_query(param)
+                      for param in rhs_params]
+        return '%s ILIKE %s' % (lhs, rhs), lhs_params + rhs_params
+
+def related_text(model, field, separator=' ', part='pk'):
+    """every value of field for a part joined into one string, can be used in an
+    UPDATE of Part. part is the outer column holding the part's id"""
+    return Subquery(model.objects.filter(part=OuterRef(part)).values('part')
+                    .annotate(text=StringAgg(field, separator)).values('text'))
+
+def part_search_vector():
+    #part numbers rank highest, then description and type, then parameters and locations
+    type_name = Subquery(Type.objects.filter(id=OuterRef('partType_id')).values('name'))
+    return (SearchVector('engimusingPartNumber', weight='A') +
+            SearchVector(related_text(ManufacturerRelationship, 'partNumber'), weight='A') +
+            SearchVector('description', weight='B') +
+            SearchVector(type_name, weight='B') +
+            SearchVector(related_text(ManufacturerRelationship, 'manufacturer__name'), weight='B') +
+            SearchVector(attribute_text(), weight='C') +
+            SearchVector(related_text(LocationRelationship, 'location__name'), weight='D'))
+
+def update_search_vector(part_ids=None):
+    """recalculate the stored Part.search_vector in one UPDATE, for every
+    part if part_ids isn't given"""
+    parts = Part.objects.all() if part_ids is None else Part.objects.filter(id__in=part_ids)
+    return parts.update(search_vector=part_search_vector())
+
+def search_parts(queryset, search):
+    """parts matching search annotated with rank, best match first. rank is cast
+    from real to double so it survives the round trip through a page cursor"""
+    query = SearchQuery(search)
+    return (queryset.filter(search_vector=query)
+            .annotate(rank=Cast(SearchRank(F('search_vector'), query), FloatField()))
+            .order_by('-rank', '-id'))
+
+def is_part_number(search):
+    #a single word with a digit in it, like LM317 or 0402, is looked up as a part number
+    return len(search.split()) == 1 and any(c.isdigit() for c in search)
+
+def part_number_score(field, search):
+    #similarity of field to search, anything starting with search goes above fuzzy matches
+    return (TrigramSimilarity(field, search) +
+            Case(When(**{field + '__istartswith': search, 'then': Value(1.0)}),
+                 default=Value(0.0), output_field=FloatField()))
+
+def search_part_numbers(queryset, search):
+    """parts whose engimusing or manufacturer part number contains or is similar
+    to search, annotated with rank, exact prefixes first then closest match"""
+    search = search.strip()
+    matches = (Q(partNumber__trgm_contains=search) |
+               Q(partNumber__trgm_similar=search))
+    manufacturer_parts = ManufacturerRelationship.objects.filter(matches).values('part_id')
+    best_manufacturer_number = Subquery(
+        ManufacturerRelationship.objects.filter(matches, part=OuterRef('pk'))
+        .annotate(score=part_number_score('partNumber', search))
+        .order_by('-score').values('score')[:1], output_field=FloatField())
+    rank = Greatest(part_number_score('engimusingPartNumber', search),
+                    Coalesce(best_manufacturer_number, Value(0.0)))
+    return (queryset.filter(Q(engimusingPartNumber__trgm_contains=search) |
+                            Q(engimusingPartNumber__trgm_similar=search) |
+                            Q(id__in=manufacturer_parts))
+            .annotate(rank=Cast(rank, FloatField()))
+            .order_by('-rank', '-id'))
+
+def find_parts(queryset, search, mode=''):
+    #mode is one of SEARCH_MODES, picked from the search term when it's blank
+    if mode == 'number' or (not mode and is_part_number(search)):
+        return search_part_numbers(queryset, search)
+    return search_parts(queryset, search)
+
+def typeahead_parts(search, mode=''):
+    """best matching parts for a picker as [{'id': .., 'label': ..}], cached
+    for a short time by the normalized search so repeat lookups don't query"""
+    search = ' '.join(search.lower().split())
+    if len(search) < TYPEAHEAD_MIN_LENGTH:
+        return []
+    key = 'typeahead:%s:%s' % (mode, hashlib.md5(search.encode('utf-8')).hexdigest())
+    results = cache.get(key)
+    if results is None:
+        parts = (find_parts(Part.objects.all(), search, mode)
+                 .values('id', 'engimusingPartNumber', 'description')[:TYPEAHEAD_LIMIT])
+        results = [{'id': part['id'],
+                    'label': '%s - %s' % (part['engimusingPartNumber'], part['description'])}
+                   for part in parts]
+        cache.set(key, results, TYPEAHEAD_CACHE_TIMEOUT)
+    return results
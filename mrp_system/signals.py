@@ -0,0 +1,139 @@
+from mrp_system.models import (Part, Type, Field, Vendor, Location, ManufacturerRelationship,
+                               PartAmount, ProductAmount, LocationRelationship,
+                               ProductLocation, ManufacturingOrder, MOProduct,
+                               PurchaseOrder, PurchaseOrderParts, PlanningChange, Job)
+from mrp_system.bom import invalidate_bom
+from mrp_system.mrp import update_part_stock, update_product_stock
+from mrp_system.search import update_search_vector
+from mrp_system.facets import invalidate_facets
+from mrp_system.parametric import update_part_values, index_type_values
+from mrp_system.jobs import enqueue, task_path
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+"""flattened BOMs are cached per product in bom.py, clear the product and
+every product that uses it whenever its parts or sub products change"""
+@receiver(post_save, sender=PartAmount)
+@receiver(post_delete, sender=PartAmount)
+def reset_part_amount_bom(sender, instance, **kwargs):
+    product_id = instance.product_id
+    transaction.on_commit(lambda: invalidate_bom(product_id))
+
+@receiver(post_save, sender=ProductAmount)
+@receiver(post_delete, sender=ProductAmount)
+def reset_product_amount_bom(sender, instance, **kwargs):
+    product_id = instance.from_product_id
+    transaction.on_commit(lambda: invalidate_bom(product_id))
+
+#keep total stock over all locations on Part and Product up to date
+@receiver(post_save, sender=LocationRelationship)
+@receiver(post_delete, sender=LocationRelationship)
+def update_part_on_hand(sender, instance, **kwargs):
+    update_part_stock([instance.part_id])
+
+@receiver(post_save, sender=ProductLocation)
+@receiver(post_delete, sender=ProductLocation)
+def update_product_on_hand(sender, instance, **kwargs):
+    update_product_stock([instance.product_id])
+
+"""record what changed since the last mrp run so it only recomputes what it
+has to, see run_mrp in mrp.py"""
+@receiver(post_save, sender=LocationRelationship)
+@receiver(post_delete, sender=LocationRelationship)
+@receiver(post_save, sender=PurchaseOrderParts)
+@receiver(post_delete, sender=PurchaseOrderParts)
+def record_part_change(sender, instance, **kwargs):
+    PlanningChange.objects.create(part_id=instance.part_id)
+
+#purchase order may have been marked as received
+@receiver(post_save, sender=PurchaseOrder)
+def record_purchase_order_change(sender, instance, **kwargs):
+    part_ids = instance.purchaseorderparts_set.values_list('part_id', flat=True)
+    PlanningChange.objects.bulk_create([PlanningChange(part_id=part_id) for part_id in part_ids])
+
+#anything that changes the demand for parts
+@receiver(post_save, sender=ManufacturingOrder)
+@receiver(post_delete, sender=ManufacturingOrder)
+@receiver(post_save, sender=MOProduct)
+@receiver(post_delete, sender=MOProduct)
+@receiver(post_save, sender=PartAmount)
+@receiver(post_delete, sender=PartAmount)
+@receiver(post_save, sender=ProductAmount)
+@receiver(post_delete, sender=ProductAmount)
+@receiver(post_save, sender=ProductLocation)
+@receiver(post_delete, sender=ProductLocation)
+def record_demand_change(sender, instance, **kwargs):
+    PlanningChange.objects.create(part_id=None)
+
+#keep Part.search_vector up to date with everything it's built from, see search.py
+@receiver(post_save, sender=Part)
+@receiver(post_save, sender=ManufacturerRelationship)
+@receiver(post_delete, sender=ManufacturerRelationship)
+@receiver(post_save, sender=LocationRelationship)
+@receiver(post_delete, sender=LocationRelationship)
+def update_part_search(sender, instance, **kwargs):
+    part_id = instance.id if sender is Part else instance.part_id
+    update_search_vector([part_id])
+
+#numeric values of the part's fields for range filters, see parametric.py
+@receiver(post_save, sender=Part)
+def update_part_index(sender, instance, **kwargs):
+    update_part_values([instance.id])
+
+#a field may now be read from another key, index the type's parts again in the worker
+@receiver(post_save, sender=Field)
+def reindex_field_type(sender, instance, **kwargs):
+    type_id = instance.typePart_id
+    if type_id is None or not Part.objects.filter(partType_id=type_id).exists():
+        return
+    #editing a type saves every field, one job is enough
+    if not Job.objects.filter(task=task_path(index_type_values), status='queued',
+                              kwargs={'type_id': type_id}).exists():
+        enqueue(index_type_values, type_id=type_id)
+
+#renaming a type, vendor or location changes the search text of all of its parts
+@receiver(post_save, sender=Type)
+def update_type_search(sender, instance, created, **kwargs):
+    if not created:
+        update_search_vector(Part.objects.filter(partType=instance).values('id'))
+
+@receiver(post_save, sender=Vendor)
+def update_vendor_search(sender, instance, created, **kwargs):
+    if not created:
+        update_search_vector(ManufacturerRelationship.objects.filter(manufacturer=instance).values('part_id'))
+
+@receiver(post_save, sender=Location)
+def update_location_search(sender, instance, created, **kwargs):
+    if not created:
+        update_search_vector(LocationRelationship.objects.filter(location=instance).values('part_id'))
+
+"""part list filter choices are cached per type in facets.py, clear them when
+anything they're counted from changes"""
+@receiver(post_save, sender=Part)
+@receiver(post_delete, sender=Part)
+def reset_part_facets(sender, instance, **kwargs):
+    type_ids = [instance.partType_id]
+    transaction.on_commit(lambda: invalidate_facets(type_ids))
+
+@receiver(post_save, sender=ManufacturerRelationship)
+@receiver(post_delete, sender=ManufacturerRelationship)
+@receiver(post_save, sender=LocationRelationship)
+@receiver(post_delete, sender=LocationRelationship)
+def reset_relationship_facets(sender, instance, **kwargs):
+    type_ids = list(Part.objects.filter(id=instance.part_id).values_list('partType_id', flat=True))
+    transaction.on_commit(lambda: invalidate_facets(type_ids))
+
+@receiver(post_save, sender=Field)
+@receiver(post_delete, sender=Field)
+def reset_field_facets(sender, instance, **kwargs):
+    type_ids = [instance.typePart_id] if instance.typePart_id else []
+    transaction.on_commit(lambda: invalidate_facets(type_ids))
+
+#names are shown in every type's choices
+@receiver(post_save, sender=Vendor)
+@receiver(post_delete, sender=Vendor)
+@receiver(post_save, sender=Location)
+@receiver(post_delete, sender=Location)
+def reset_all_facets(sender, instance, **kwargs):
+    transaction.on_commit(invalidate_facets)
@@ -4,6 +4,9 @@ register = template.Library()
 
 @register.filter
 def get_obj_attr(obj, attr):
+    #a part's fields are read from its attributes by their key
+    if not hasattr(obj, attr) and hasattr(obj, 'get_attribute'):
+        return obj.get_attribute(attr)
     return getattr(obj, attr)
 
 def phonenumber(value):
@@ -0,0 +1,59 @@
+from django.test import SimpleTestCase
+
+from mrp_system.parametric import parse_quantity, format_quantity, parse_range
+
+
+class ParseQuantityTests(SimpleTestCase):
+
+    def test_prefixed_units(self):
+        self.assertEqual(parse_quantity('10kOhms'), (10000.0, 'Ohm'))
+        self.assertEqual(parse_quantity('0.1µF'), (1e-07, 'F'))
+        self.assertEqual(parse_quantity('100nF'), parse_quantity('0.1uF'))
+        self.assertEqual(parse_quantity('25 V'), (25.0, 'V'))
+
+    def test_capital_prefixes(self):
+        self.assertEqual(parse_quantity('100PF'), (1e-10, 'F'))
+        self.assertEqual(parse_quantity('10UF'), (1e-05, 'F'))
+        self.assertEqual(parse_quantity('4.7KOHM'), (4700.0, 'Ohm'))
+        self.assertEqual(parse_quantity('10 Pa'), (10.0, 'Pa'))
+
+    def test_units_without_prefixes(self):
+        self.assertEqual(parse_quantity('±5%'), (5.0, '%'))
+        self.assertEqual(parse_quantity('20ppm'), (20.0, 'ppm'))
+        self.assertEqual(parse_quantity('12'), (12.0, ''))
+
+    def test_alternatives(self):
+        self.assertEqual(parse_quantity('0.25W, 1/4W'), (0.25, 'W'))
+
+    def test_not_quantities(self):
+        for text in ['1/4W', '0402', '', 'SMD', '1,000', '10V/us', 'inf']:
+            self.assertIsNone(parse_quantity(text), text)
+
+
+class ParseRangeTests(SimpleTestCase):
+
+    def test_range(self):
+        self.assertEqual(parse_range('90nF', '0.11uF'), (9e-08, 1.1e-07, 'F'))
+        self.assertEqual(parse_range('25', '50V'), (25.0, 50.0, 'V'))
+        self.assertEqual(parse_range('', '1A'), (None, 1.0, 'A'))
+
+    def test_not_ranges(self):
+        self.assertIsNone(parse_range('', ''))
+        self.assertIsNone(parse_range('10nF', '5V'))
+
+
+class FormatQuantityTests(SimpleTestCase):
+
+    def test_prefixed_units(self):
+        self.assertEqual(format_quantity(10000.0, 'Ohm'), '10kOhm')
+        self.assertEqual(format_quantity(1e-07, 'F'), '100nF')
+        self.assertEqual(format_quantity(0.25, 'W'), '250mW')
+        self.assertEqual(format_quantity(0, 'V'), '0V')
+
+    def test_units_without_prefixes(self):
+        self.assertEqual(format_quantity(5.0, '%'), '5%')
+        self.assertEqual(format_quantity(1500.0), '1.5k')
+
+    def test_round_trip(self):
+        for text in ['10kOhm', '100nF', '25V', '4.7µH']:
+            self.assertEqual(format_quantity(*parse_quantity(text)), text)
@@ -23,6 +23,18 @@ urlpatterns = [
     url(r'^parts/(?P<type_id>\d+)/$',
         views.ListParts,
         name='list_parts'),
+    url(r'^parts/(?P<type_id>\d+)/facets/$',
+        views.part_facets,
+        name='part_facets'),
+    url(r'^parts/(?P<type_id>\d+)/import/$',
+        views.import_parts_view,
+        name='import_parts'),
+    url(r'^parts/(?P<type_id>\d+)/import/(?P<import_id>\d+)/$',
+        views.import_detail,
+        name='import_detail'),
+    url(r'^parts/(?P<type_id>\d+)/export/$',
+        views.export_parts,
+        name='export_parts'),
     url(r'^part/create/(?P<type_id>\d+)/$',
         views.PartCreate,
         name='create_part'),
@@ -61,6 +73,9 @@ urlpatterns = [
     url('vendor/merge/',
         views.MergeVendorView,
         name='merge_vendors'),
+    url('duplicates/$',
+        views.duplicates_view,
+        name='duplicates'),
     url('location/merge/',
         views.MergeLocationView,
         name='merge_locations'),
@@ -78,6 +93,12 @@ urlpatterns = [
     url('digikey/enter/$',
         views.enter_digi_part,
         name='digi_part'),
+    url('digikey/intake/$',
+        views.intake_parts,
+        name='intake_parts'),
+    url('digikey/intake/(?P<batch_id>\d+)/$',
+        views.intake_detail,
+        name='intake_detail'),
     url('tokens/$',
         views.print_tokens_digi,
         name='print_tokens'),
@@ -124,11 +145,17 @@ urlpatterns = [
     url('mo/(?P<mo_id>\d+)/$',
         views.MODetailView,
         name='detail_mo'),
+    url('mo/plan/$',
+        views.mrp_plan_view,
+        name='mrp_plan'),
 
     #purchase orders
     url('purchase_order/$',
         views.po_list_view,
         name='list_po'),
+    url('purchase_order/export/$',
+        views.export_purchase_orders,
+        name='export_po'),
     url('purchase_order/create/$',
         views.create_purchase_order,
         name='create_po'),
@@ -1,12 +1,33 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import (HttpResponse, HttpResponseRedirect, HttpResponseNotFound,
-                         JsonResponse)
+from django.http import (HttpResponseRedirect, HttpResponseNotFound,
+                         JsonResponse, Http404)
 from django.views.generic import ListView, TemplateView
 from mrp_system.models import (Part, Type, Field, Vendor,
                                ManufacturerRelationship, Location,
                                LocationRelationship, DigiKeyAPI,
                                PartAmount, Product, ProductAmount, ManufacturingOrder,
-                               MOProduct, ProductLocation, PurchaseOrder, PurchaseOrderParts)
+                               MOProduct, PurchaseOrder,
+                               PlannedRequirement, PlanningChange, IntakeBatch,
+                               DuplicateCandidate, PartImport, part_prefetches)
+from mrp_system.bom import explode_products, BOMCycleError
+from mrp_system.mrp import plan_requirements, run_mrp, generate_purchase_orders, order_shortages
+from mrp_system.pagination import keyset_page, PAGE_SIZES
+from mrp_system.facets import live_facets, filter_names, RELATED_FILTERS
+from mrp_system.attributes import attribute_filter, field_key
+from mrp_system.parametric import (range_filters, range_filter, nearest_filter, nearest_parts,
+                                   format_quantity, format_range)
+from mrp_system.imports import start_import
+from mrp_system.merge import merge_objects
+from mrp_system.duplicates import (find_duplicates, merge_candidate, candidate_objects,
+                                   DUPLICATES_PAGE_SIZE)
+from mrp_system.exports import (export_response, part_export, bom_export, mo_export,
+                                purchase_order_export)
+from mrp_system.digikey import get_client, lookup_cache_stats, DigiKeyError
+from mrp_system.intake import (get_part_type, set_part_fields, part_params,
+                               part_description, part_manufacturer, datasheet_url,
+                               fetch_datasheet, start_intake)
+from mrp_system.jobs import enqueue
+from mrp_system.search import find_parts, typeahead_parts, TYPEAHEAD_CACHE_TIMEOUT
 from mrp_system.forms import (FilterForm, PartForm, LocationForm, LocationFormSet,
                               MergeLocationsForm, ManufacturerFormSet,
                               MergeVendorsForm, FieldFormSet, TypeForm, APIForm,
@@ -14,21 +35,23 @@ from mrp_system.forms import (FilterForm, PartForm, LocationForm, LocationFormSe
                               ProductToProductFormSet, ProductLocationFormSet,
                               ManufacturingOrderForm, ManufacturingProductFormSet,
                               EditFieldFormSet, QuickTypeForm, EnterTokensForm,
-                              VendorForm, PurchaseOrderForm, POPartFormSet)
+                              VendorForm, PurchaseOrderForm, POPartFormSet,
+                              ImportPartsForm, IntakeForm)
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
 from django.forms.models import inlineformset_factory
 from django.urls import reverse, reverse_lazy
 from django.forms import ModelForm
 from django import forms
 from django.db.models.functions import Cast
-from django.db.models import CharField, Sum
-from django.contrib.postgres.search import SearchVector
+from django.db.models import CharField, Sum, Max, Count, F, Q
+from django.contrib.postgres.search import SearchQuery, SearchRank
 from django.core.files.storage import DefaultStorage
-import requests, json, urllib, xlsxwriter, io, sys, re, time
+from django.core.exceptions import ObjectDoesNotExist
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+import urllib, time, hashlib
 from bs4 import BeautifulSoup
-from urllib.parse import urlparse
 from django.contrib import messages
-from django.core.files.base import ContentFile
 from django.utils.safestring import mark_safe
 from itertools import chain
 
@@ -49,13 +72,9 @@ def quick_type_create(request):
             suffix = data.pop(0).strip()
             fields = {}
             number = 1
-            #assign each field to a character field up to 35
+            #give each field its own key in the parts' attributes
             for d in data:
-                if number > 35:
-                    messages.warning(request, ('Part model can only track 35 fields.'))
-                    url = reverse('quick_type')
-                    return HttpResponseRedirect(url)
-                fields[d.strip()] = "char"+str(number)
+                fields[d.strip()] = field_key(number)
                 number += 1
             #create type and field models    
             partType = Type.objects.create(name=typeName, prefix=suffix)
@@ -99,10 +118,9 @@ class TypeCreate(CreateView):
         field_formset.instance = self.object
         forms = field_formset.save(commit=False)
         count = 1
-        """assign field names to fields, don't need to check for 35 because
-        only allows 35 fields in form"""
+        #assign each field its key in the parts' attributes
         for f in forms:
-            f.fields = 'char' + str(count)
+            f.fields = field_key(count)
             count += 1
             f.save()
         return super(TypeCreate, self).form_valid(form)
@@ -213,15 +231,30 @@ def PartEdit(request, type_id, id):
                                             'manu_formset': manu_formset,
                                             'partType': partType})
 
+def filter_parts(request, parts, fields):
+    """apply the filters chosen on the part list (GET parameters) to parts,
+    fields are the type's Field rows. Returns the parts, the {filter name: values}
+    filters and the {Field: (low, high, unit)} value ranges that were used"""
+    filters = {}
+    for n in filter_names([field.fields for field in fields]):
+        if request.GET.getlist(n):
+            filters[n] = request.GET.getlist(n)
+    for name, values in filters.items():
+        if name in RELATED_FILTERS:
+            #as a subquery so manufacturer/location joins don't repeat parts
+            parts = parts.filter(id__in=Part.objects.filter(**{name + '__in': values}).values('id'))
+        else:
+            parts = parts.filter(attribute_filter(name, values))
+    #numeric ranges are read from the PartValue index, see parametric.py
+    ranges = range_filters(request.GET, fields)
+    for field, (low, high, unit) in ranges.items():
+        parts = parts.filter(range_filter(field.id, low, high, unit))
+    return parts, filters, ranges
+
 def ListParts(request, type_id):
-    filters={}
     partType = Type.objects.get(id=type_id)
     parts = Part.objects.filter(partType=partType)
-    fields = Field.objects.filter(typePart_id=type_id)
-    #list of all possible fields
-    list_fields = ['manufacturer','location']
-    for x in range(1,36):
-        list_fields.append('char' + str(x))
+    fields = list(Field.objects.filter(typePart_id=type_id))
     name = ''
     for field in fields:
         if field.fields == "char1":
@@ -230,49 +263,100 @@ def ListParts(request, type_id):
     models={}
     for field in fields:
         models[field.fields] = field.name
-    if request.method == 'POST':
-        #pass list of fields and field names for part type to filter form
-        form = FilterForm(request.POST, models=models, type_id=type_id)
-        #add all filters that have been selected
-        for n in list_fields:
-            if request.POST.getlist(n):
-                filters[n + '__in'] = request.POST.getlist(n)
-        searchField = request.POST.get('search')
-        #reset a blank form that could be filtered again
-        form=FilterForm(models=models, type_id=type_id)
-    else:
-        form = FilterForm(models=models, type_id=type_id)
-    #apply filters to part list
-    parts = parts.filter(**filters)
+    #filters are GET parameters so they carry over between pages
+    form = FilterForm(models=models, type_id=type_id)
+    parts, filters, ranges = filter_parts(request, parts, fields)
+    near = nearest_filter(request.GET, fields)
+    searchField = request.GET.get('search')
+    searchMode = request.GET.get('search_mode', '')
     #create list of current filters to notify user
     string_filters = 'Current Filters: '
     for key, value in filters.items():
-        if key == 'location__in':
+        if key == 'location':
             locations = Location.objects.filter(id__in=value)
             string_filters += ", ".join(l.name for l in locations) + '; '
-        elif key == 'manufacturer__in':
+        elif key == 'manufacturer':
             manufacturers = Vendor.objects.filter(id__in=value)
             string_filters += ", ".join(m.name for m in manufacturers) + '; '
         else:
             string_filters += ", ".join(v for v in value) + '; '
+    for field, value_range in ranges.items():
+        string_filters += '%s %s; ' % (field.name, format_range(*value_range))
+    if near:
+        string_filters += '%s closest to %s; ' % (near[0].name, format_quantity(near[1], near[2]))
     string_filters += "\t Search Field: "
     if searchField:
         string_filters += searchField
-    if searchField == "" or searchField is None:
-        parts = parts.distinct('id')
+    #locations, stock and manufacturers for the whole table in a fixed number of queries
+    parts = parts.prefetch_related(*part_prefetches())
+    if searchField:
+        #apply search field, best matches first
+        parts = find_parts(parts, searchField, searchMode)
+    if near:
+        #values closest to the one asked for first
+        field, target, unit = near
+        parts = nearest_parts(parts, field.id, target, unit)
+        page = keyset_page(parts, request, 'distance')
+    elif searchField:
+        page = keyset_page(parts, request, 'rank', descending=True)
     else:
-        #apply search field
-        parts = parts.annotate(search=SearchVector('manufacturer__name', 'location__name', 'description',
-                                                   'engimusingPartNumber', 'manufacturerrelationship__partNumber',
-                                                   'char1', 'char2','char3','char4','char5','char6','char7','char8',
-                                                   'char9','char10','char11','char12','char13','char14','char15',
-                                                   'char16','char17','char18','char19','char20','char21','char22',
-                                                   'char23','char24','char25','char26','char27','char28','char29',
-                                                   'char30','char31','char32','char33','char34','char35')).filter(search=searchField)
-        parts = parts.distinct('id')
-    return render(request, 'part_list.html', {'type': partType, 'parts': parts,
+        page = keyset_page(parts, request, 'engimusingPartNumber')
+    #current filters without the page position, used to build next/previous links
+    query = request.GET.copy()
+    for key in ('after', 'before'):
+        query.pop(key, None)
+    return render(request, 'part_list.html', {'type': partType, 'parts': page,
                                               'fields': fields, 'form': form,
-                                              'name': name, 'string_filters': string_filters})
+                                              'name': name, 'string_filters': string_filters,
+                                              'query': query.urlencode(), 'page_sizes': PAGE_SIZES})
+
+def part_facets(request, type_id):
+    #live counts for the part list filters as JSON, takes the same GET parameters as ListParts
+    fields = list(Field.objects.filter(typePart_id=type_id))
+    keys = [field.fields for field in fields]
+    filters = {name: request.GET.getlist(name) for name in filter_names(keys)}
+    parts = None
+    searchField = request.GET.get('search')
+    if searchField:
+        parts = find_parts(Part.objects.filter(partType_id=type_id), searchField,
+                           request.GET.get('search_mode', ''))
+    return JsonResponse(live_facets(type_id, keys, filters, parts,
+                                    range_filters(request.GET, fields)))
+
+#create parts of a type from an uploaded csv or xlsx file, imported in the background
+def import_parts_view(request, type_id):
+    partType = get_object_or_404(Type, id=type_id)
+    if request.method == 'POST':
+        form = ImportPartsForm(request.POST, request.FILES)
+        if form.is_valid():
+            part_import = start_import(partType, form.cleaned_data['file'])
+            return HttpResponseRedirect(reverse('import_detail', args=[type_id, part_import.id]))
+    else:
+        form = ImportPartsForm()
+    imports = PartImport.objects.filter(partType=partType).order_by('-date_created')[:20]
+    return render(request, 'import_parts.html', {'form': form, 'type': partType,
+                                                 'imports': imports,
+                                                 'fields': partType.field.all()})
+
+#result of an import, the page reloads itself until the import is finished
+def import_detail(request, type_id, import_id):
+    part_import = get_object_or_404(PartImport.objects.select_related('partType'),
+                                    id=import_id, partType_id=type_id)
+    return render(request, 'import_detail.html', {'part_import': part_import,
+                                                  'type': part_import.partType,
+                                                  'running': part_import.status in ('pending', 'running')})
+
+#current part list, with its filters and search, as csv or xlsx
+def export_parts(request, type_id):
+    partType = get_object_or_404(Type, id=type_id)
+    fields = Field.objects.filter(typePart=partType).order_by('id')
+    parts, filters, ranges = filter_parts(request, Part.objects.filter(partType=partType), fields)
+    searchField = request.GET.get('search')
+    if searchField:
+        parts = parts.filter(id__in=find_parts(Part.objects.filter(partType=partType), searchField,
+                                               request.GET.get('search_mode', '')).values('id'))
+    header, rows = part_export(parts, fields)
+    return export_response(request.GET.get('format'), '%s-parts' % partType.name, header, rows)
 
 class DeletePart(DeleteView):
     model = Part
@@ -409,22 +493,7 @@ def MergeVendorView(request):
                 return redirect(reverse('merge_vendors'))
 
             #replace all instance of alias vendor with primary vendor
-            parts = alias_object.part_set.all()
-            partNumber = []
-            partSet = []
-            #get all needed information from alias_object
-            for part in parts:
-                m = ManufacturerRelationship.objects.get(part=part, manufacturer=alias_object)
-                partNumber.append(m.partNumber)
-                partSet.append(m.part)
-            alias_object.part_set.clear()
-            length = len(partSet)
-            #set all alias_object relationships to primary object
-            for x in range(length):
-                ManufacturerRelationship.objects.create(part=partSet[x],
-                                                        manufacturer=primary_object,
-                                                        partNumber=partNumber[x])
-            alias_object.delete()
+            merge_objects(primary_object, alias_object)
             return redirect('list_vendors')
     else: form = MergeVendorsForm()
     return render(request, "merge_vendors.html", {"form":form})
@@ -449,25 +518,9 @@ def MergeLocation(primary_object, alias_object):
     if not isinstance(primary_object, Location):
         raise TypeError('Only Location instances can be merged')
 
-    parts = alias_object.part_set.all()
-    stock = []
-    partSet = []
-    #get all needed information from alias_object
-    for part in parts:
-        l = LocationRelationship.objects.get(part=part, location=alias_object)
-        stock.append(l.stock)
-        partSet.append(l.part)
-    alias_object.part_set.clear()
-    length = len(partSet)
-    #set all alias_object relationships to primary object
-    for x in range(length):
-        LocationRelationship.objects.create(part=partSet[x],
-                                            location=primary_object,
-                                            stock=stock[x])
-    alias_object.delete()
-
-
-import http.client
+    #move all of alias_object's parts, products and stock to primary object
+    merge_objects(primary_object, alias_object)
+
 
 def enter_digi_part(request):
     if request.method == "POST":
@@ -477,145 +530,43 @@ def enter_digi_part(request):
             partNumber = form.cleaned_data['partNumber']
             manuPartNumb = form.cleaned_data['manuPartNumber']
             website = form.cleaned_data['website']
-            #this model holds the access and refresh token for digikey API
-            digi = DigiKeyAPI.objects.get(name="DigiKey")
-            
-            #get new access token with refresh token
-            API_ENDPOINT = "https://sso.digikey.com/as/token.oauth2"
-
-            data = {'client_id': '73432ca9-e8ba-4965-af17-a22107f63b35',
-                    'client_secret': 'G2rQ1cM8yM4gV6rW2nA1wL2yF7dN4sX4fJ2lV6jE5uT0bB0uG8',
-                    'refresh_token': digi.refresh_token,
-                    'grant_type': 'refresh_token'
-                    }
-            r = requests.post(url = API_ENDPOINT, data=data)
-            response = r.json()
+            #the client keeps its connections and access token between lookups
+            client = get_client()
             try:
-                refreshToken = response['refresh_token']
-            except (IndexError, KeyError):
-                messages.warning(request, ('Digi-Key access tokens are off.'))
+                #if digikey barcode, use barcode api to get part number
+                if website == 'Digi-Key' and barcode:
+                    search = client.barcode_part_number(barcode)
+                    if not search:
+                        return HttpResponseNotFound('<h1>Invalid barcode.</h1>')
+
+                #if mouser barcode, its a manufacturer number
+                elif website == 'Mouser' and barcode:
+                    search = barcode
+
+                elif partNumber:
+                    search = partNumber
+                elif manuPartNumb:
+                    search = manuPartNumb
+
+                else:
+                    return HttpResponseNotFound('<h1>Must select a website and enter a field!</h1>')
+
+                #get part information from part number or manufacturer part number
+                part = client.find_part(search)
+            except DigiKeyError as e:
+                messages.warning(request, str(e))
                 url = reverse('digi_part')
                 return HttpResponseRedirect(url)
-
-            #set access and refresh token from tokens returned with API
-            accessToken = response['access_token']
-            setattr(digi,"refresh_token",refreshToken)
-            setattr(digi,"access_token",accessToken)
-            digi.save()
-            #if digikey barcode, use barcode api to get part number
-            if website == 'Digi-Key' and barcode:
-                conn = http.client.HTTPSConnection("api.digikey.com")
-
-                headers = {
-                    'x-ibm-client-id': '73432ca9-e8ba-4965-af17-a22107f63b35',
-                    'authorization': digi.access_token,
-                    'accept': "application/json"
-                    }
-
-                conn.request("GET", "/services/barcode/v1/productbarcode/" + barcode, headers=headers)
-
-                res = conn.getresponse()
-                data = res.read().decode("utf-8")
-                part = json.loads(data)
-                partNumber = part['DigiKeyPartNumber']
-                search = partNumber
-
-            #if mouser barcode, its a manufacturer number
-            elif website == 'Mouser' and barcode:
-                search = barcode
-                
-            elif partNumber:
-                search = partNumber
-            elif manuPartNumb:
-                search = manuPartNumb
-                
-            else:
-                return HttpResponseNotFound('<h1>Must select a website and enter a field!</h1>')
-
-            #get part information from part number or manufacturer part number
-            conn = http.client.HTTPSConnection("api.digikey.com")
-
-            payload = "{\"SearchOptions\":[\"ManufacturerPartSearch\"],\"Keywords\":\"" + search + "\",\"RecordCount\":\"10\",\"RecordStartPosition\":\"0\",\"Filters\":{\"CategoryIds\":[27442628],\"FamilyIds\":[81316194],\"ManufacturerIds\":[88520800],\"ParametricFilters\":[{\"ParameterId\":\"725\",\"ValueId\":\"7\"}]},\"Sort\":{\"Option\":\"SortByUnitPrice\",\"Direction\":\"Ascending\",\"SortParameterId\":\"50\"},\"RequestedQuantity\":\"50\"}"
-
-            headers = {
-                'x-ibm-client-id': '73432ca9-e8ba-4965-af17-a22107f63b35',
-                'x-digikey-locale-site': "US",
-                'x-digikey-locale-language': "en",
-                'x-digikey-locale-currency': "USD",
-                'authorization': digi.access_token,
-                'content-type': "application/json",
-                'accept': "application/json"
-                }
-
-            conn.request("POST", "/services/partsearch/v2/keywordsearch", payload, headers)
-
-            res = conn.getresponse()
-            string = res.read().decode('utf-8')
-            sys.stdout.flush()
-            jstr = json.loads(string)
-            try:
-                part = jstr['ExactDigiKeyPart']
-                data = part['Parameters']
-            except(IndexError, KeyError, TypeError):
-                try:
-                    part=jstr['ExactParts'][0]
-                    data = part['Parameters']
-                except(IndexError, KeyError, TypeError):
-                    if website == 'Mouser' and barcode:
-                        return HttpResponseNotFound('<h1>Invalid part number. Ensure the manufacturer part number exists on digi-key.</h1>')
-                    else:
-                        return HttpResponseNotFound('<h1>Invalid Part Number.</h1>')
+            if part is None:
+                if website == 'Mouser' and barcode:
+                    return HttpResponseNotFound('<h1>Invalid part number. Ensure the manufacturer part number exists on digi-key.</h1>')
+                else:
+                    return HttpResponseNotFound('<h1>Invalid Part Number.</h1>')
             #grab all parameters returned from api
-            params = {}
-            for value in data:
-                params[value['Parameter']] = value['Value']
-            typeName = part['Family']['Text']
-            partType, created = Type.objects.get_or_create(name=typeName)
-            count = 1
-            #if new part type, assign prefix
-            if created:
-                #get all words in type name, exclude -'s
-                list_name = re.findall(r'\w+', typeName)
-                #get word count
-                word_count = len(list_name)
-                #assign prefix based on amount of words in type name
-                prefix = ""
-                if word_count == 1:
-                    prefix = typeName[:3].upper()
-                if word_count == 2:
-                    prefix = (list_name[0][:1] + list_name[1][:2]).upper()
-                if word_count >= 3:
-                    prefix = (list_name[0][:1] + list_name[1][:1] + list_name[2][:1]).upper()
-                setattr(partType,"prefix",prefix)
-                partType.save()
-                #series is always separate from the other parameters 
-                try:
-                    part['Series']['Parameter']
-                    Field.objects.create(name='Series',fields='char1', typePart=partType)
-                    count = 2
-                except(IndexError, KeyError, TypeError):
-                    count = 1
-                for name, value in params.items():
-                    #print("here")
-                    if count <= 35:
-                        field = "char" + str(count)
-                        Field.objects.create(name=name, fields=field, typePart=partType)
-                        count += 1
-                    #part model only allows for 35 fields currently
-                    else:
-                        messages.warning(request, ('Can\'t create type, too many fields.'))
-                        url = reverse('digi_part')
-                        return HttpResponseRedirect(url)
-            fields = Field.objects.filter(typePart=partType)
-            description = part['DetailedDescription']
-            if not description:
-                description = part['ProductDescription']
-            try:
-                number = part['ManufacturerPartNumber']
-                manufacturer = part['ManufacturerName']['Text']
-            except(IndexError, KeyError, TypeError):
-                number = None
-                manufacturer = None
+            params = part_params(part)
+            partType, fields = get_part_type(part, params)
+            description = part_description(part)
+            manufacturer, number = part_manufacturer(part)
             if manufacturer:
                 manu, created = Vendor.objects.get_or_create(name=manufacturer, vendor_type="manufacturer")
                 #this is our way of checking for duplicates
@@ -624,64 +575,80 @@ def enter_digi_part(request):
                     messages.warning(request, ('Manufacturer Part Number already exists.'))
                     url = reverse('digi_part')
                     return HttpResponseRedirect(url)
-            new_part = Part.objects.create(partType=partType, description=description)
+            #datasheet is downloaded by the job worker, the part shows it as pending until then
+            url = datasheet_url(part)
+            new_part = Part(partType=partType, description=description, datasheet_pending=bool(url))
+            set_part_fields(new_part, part, params, fields)
+            new_part.save()
             if manufacturer:
                 ManufacturerRelationship.objects.create(part=new_part, manufacturer=manu, partNumber=number)
-            for field in fields:
-                name = field.name
-                field_name = field.fields
-                #composition parameter is formatted differently
-                if field.name == "Composition":
-                    try:
-                        value = part['Family']['Text']
-                        setattr(new_part, field.fields, value)
-                    except(IndexError, KeyError):
-                        pass
-                #try to get each value and assign it to the part
-                try:
-                    value = part[name]['Value']
-                    setattr(new_part, field.fields, value)
-                except(IndexError, KeyError):
-                    try:
-                        value = params[name]
-                        setattr(new_part, field.fields, value)
-                    except(IndexError, KeyError):
-                        pass
-            new_part.save()
-            #assign datasheet if it exists
-            try:
-                datasheet_url = part['PrimaryDatasheet']
-                if 'pdf' in datasheet_url:
-                    try:
-                        datasheet_name = urlparse(datasheet_url).path.split('/')[-1]
-                        headers = {'User-Agent': 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:35.0) Gecko/20100101 Firefox/35.0'}
-                        response = requests.get(datasheet_url, headers=headers, timeout=5)
-                        if response.status_code == 200:
-                            new_part.datasheet.save(datasheet_name, ContentFile(response.content), save=True)
-                    except (requests.exceptions.SSLError):
-                        pass
-            except(IndexError, KeyError, TypeError):
-                pass
+            if url:
+                enqueue(fetch_datasheet, part_id=new_part.id, url=url)
             redirect_url = reverse('edit_part', args=[partType.pk, new_part.id])
             return HttpResponseRedirect(redirect_url)
     else:
         form = APIForm()
     return render(request, "oauth.html", {'form': form})
 
+#enter a list of barcodes/part numbers, they're looked up and created in the background
+def intake_parts(request):
+    if request.method == "POST":
+        form = IntakeForm(request.POST)
+        if form.is_valid():
+            batch = start_intake(form.cleaned_data['website'], form.cleaned_data['entry_type'],
+                                 form.cleaned_data['entries'])
+            return HttpResponseRedirect(reverse('intake_detail', args=[batch.id]))
+    else:
+        form = IntakeForm()
+    batches = (IntakeBatch.objects.annotate(count=Count('items'))
+               .order_by('-date_created')[:20])
+    return render(request, 'intake.html', {'form': form, 'batches': batches})
+
+#progress of a batch, the page reloads itself until the batch is finished
+def intake_detail(request, batch_id):
+    batch = get_object_or_404(IntakeBatch, id=batch_id)
+    items = batch.items.select_related('part').order_by('id')
+    counts = dict(batch.items.values_list('status').annotate(count=Count('id')).order_by())
+    return render(request, 'intake_detail.html', {'batch': batch, 'items': items,
+                                                  'counts': counts,
+                                                  'waiting': counts.get('pending', 0) + counts.get('found', 0),
+                                                  'running': batch.status in ('pending', 'running')})
+
+#suggested duplicates found by find_duplicates, merged or dismissed one at a time
+def duplicates_view(request):
+    if request.method == 'POST':
+        if 'findBtn' in request.POST:
+            enqueue(find_duplicates, max_attempts=1)
+            messages.success(request, 'Looking for duplicates, refresh this page in a minute.')
+        else:
+            candidate = get_object_or_404(DuplicateCandidate, id=request.POST.get('candidate'),
+                                          status='open')
+            action = request.POST.get('action')
+            if action == 'dismiss':
+                candidate.status = 'dismissed'
+                candidate.save()
+            elif action in ('merge', 'swap'):
+                try:
+                    merge_candidate(candidate, swap=(action == 'swap'))
+                except (ObjectDoesNotExist, ValueError) as e:
+                    messages.warning(request, str(e))
+        return redirect('duplicates')
+    candidates = (DuplicateCandidate.objects.filter(status='open')
+                  .order_by('kind', '-score', 'id')[:DUPLICATES_PAGE_SIZE])
+    return render(request, 'duplicates.html',
+                  {'rows': candidate_objects(list(candidates)),
+                   'total': DuplicateCandidate.objects.filter(status='open').count(),
+                   'page_size': DUPLICATES_PAGE_SIZE})
+
 """used in create/edit product form to filter parts in dropdown
 called in template with javascript"""
 def get_parts(request):
-    searchField = request.GET.get('search')
-    if searchField:
-        parts = Part.objects.annotate(search=SearchVector('partType__name', 'description', 'location__name',
-                                                      'engimusingPartNumber', 'manufacturer__name',
-                                                      'manufacturerrelationship__partNumber'),).filter(search=searchField)
-    else:
-        parts = Part.objects.all()
-    parts_dict = {}
-    for part in parts:
-        parts_dict[part.id] = part.engimusingPartNumber + " - " + part.description
-    return JsonResponse(parts_dict)
+    #typeahead for the part dropdowns on the product and purchase order forms
+    results = typeahead_parts(request.GET.get('search', ''), request.GET.get('search_mode', ''))
+    response = JsonResponse({'results': results})
+    response['ETag'] = quote_etag(hashlib.md5(response.content).hexdigest())
+    patch_cache_control(response, private=True, max_age=TYPEAHEAD_CACHE_TIMEOUT)
+    return get_conditional_response(request, etag=response['ETag'], response=response)
 
 def CreateProduct(request):
     if request.method == 'POST':
@@ -759,74 +726,19 @@ def ProductDetailView(request, product_id):
                                                    'component_products': component_products})
 
 #used to gather Bill of material details into a downloadable excel sheet
-def bomExcel(parts, description):
-    output = io.BytesIO()
-    title = "BOM-%s.xlsx" % description
-    workbook = xlsxwriter.Workbook(output, {'in_memory': True})
-    worksheet = workbook.add_worksheet()
-    row = 0
-    col = 0
-    worksheet.write(row, col, 'Quantity')
-    worksheet.write(row, col + 1, 'Engimusing Part Number')
-    worksheet.write(row, col + 2, 'Manufacturer')
-    worksheet.write(row, col + 3, 'Manufacturer Part Number')
-    worksheet.write(row, col + 4, 'Description')
-    row += 1
-    for key, value in parts.items():
-        worksheet.write(row, col, value)
-        worksheet.write(row, col + 1, key.engimusingPartNumber)
-        worksheet.write(row, col + 2, ",".join(p['manufacturer__name'] for p in
-                                               key.manufacturerrelationship_set.values('manufacturer__name')))
-        worksheet.write(row, col + 3, ",".join(p['partNumber'] for p in
-                                               key.manufacturerrelationship_set.values('partNumber')))
-        worksheet.write(row, col + 4, key.description)
-        row += 1
-
-    workbook.close()
-
-    output.seek(0)
-
-    #need this so that file will be downloaded
-    response = HttpResponse(output, content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-    response['Content-Disposition'] = 'attachment; filename=%s' % title
-
-    return response                
-
 def billOfMaterialsDetail(request, product_id):
     product = get_object_or_404(Product, id=product_id)
-    parts = {}
-    #get all parts assigned to product
-    partList = product.partamount_set.all()
-    #create dictionary to group parts and assign value of total amount for duplicate parts
-    for p in partList:
-        if parts.get(p.part):
-            parts[p.part]+=p.amount
-        else:
-            parts[p.part]=p.amount
-    #get all sub products
-    products = ProductAmount.objects.filter(from_product=product)
-    while products:
-        #copy over products and then clear queryset so it can be reassigned
-        productList = products
-        products = ProductAmount.objects.none()
-        for pr in productList:
-            partList2 = pr.to_product.partamount_set.all()
-            #multiplier needed to get total part amount(amount * number of products)
-            multiplier = pr.amount 
-            for pa in partList2:
-                if parts.get(pa.part):
-                    parts[pa.part]+= (pa.amount * multiplier)
-                else:
-                    parts[pa.part]= (pa.amount * multiplier)
-            #if product list has multiple sub products, combine for one big product list
-            if products:
-                products = products.union(ProductAmount.objects.filter(from_product=pr.to_product))
-            else:
-                products = ProductAmount.objects.filter(from_product=pr.to_product)
-    #download BOM button has been pressed, call bomExcel function to download excel file
-    if(request.GET.get('downloadBtn')):
-        return bomExcel(parts, product.description)
+    #flatten all parts of product and its sub products into part: total amount
+    try:
+        parts, products = explode_products({product: 1})
+    except BOMCycleError as e:
+        messages.warning(request, str(e))
+        return HttpResponseRedirect(reverse('product_detail', args=[product.id]))
+    #download BOM button has been pressed, export the BOM as an excel file
+    if request.GET.get('downloadBtn') or request.GET.get('format'):
+        header, rows = bom_export(parts)
+        return export_response(request.GET.get('format', 'xlsx'), 'BOM-%s' % product.description,
+                               header, rows)
     return render(request, 'bom_detail.html', {'parts': parts, 'product': product}) 
 
 def CreateMO(request):
@@ -873,97 +785,86 @@ class DeleteMO(DeleteView):
 
 def MODetailView(request, mo_id):
     mo = get_object_or_404(ManufacturingOrder, id=mo_id)
-    #get all manufacturing order products
-    mos = mo.moproduct_set.all()
-    products = {}
-    parts = {}
-    for m in mos:
-        #get all parts in product
-        partList = m.product.partamount_set.all()
-        multiplier = m.amount
-        #assign parts to dictionary and get amount needed (product amount * part amount)
-        for p in partList:
-            #if multiple of same part, combine amount needed
-            if parts.get(p.part):
-                #value of dictionary will be list to hold total amount needed and amount needed minus what we have
-                parts[p.part][0] += (p.amount * multiplier)
-            else:
-                parts[p.part]= [p.amount * multiplier]
-        #get sub products
-        product_amounts = ProductAmount.objects.filter(from_product=m.product)
-        #dictionary of sub products with their total amounts
-        for pr in product_amounts:
-            if products.get(pr.to_product):
-                products[pr.to_product][0] += (pr.amount * multiplier)
-            else:
-                products[pr.to_product]= [pr.amount * multiplier]
-    #get stock for parts
-    for key, value in parts.items():
-        locs = LocationRelationship.objects.filter(part=key)
-        amount = 0
-        for l in locs:
-            amount += l.stock
-        #checked if we need more of the part then we have
-        needed = value[0] - amount
-        if needed <= 0:
-            needed = 0
-        #add amount to order to value list
-        parts[key].append(needed)
-    #do the same with product stock as with part stock
-    for key, value in products.items():
-        locs = ProductLocation.objects.filter(product=key)
-        amount = 0
-        for l in locs:
-            amount += l.stock
-        needed = value[0] - amount
-        if needed <= 0:
-            needed = 0
-        products[key].append(needed)
+    #fully explode manufacturing order products and net parts and sub products against stock
+    try:
+        parts, products = plan_requirements([mo])
+    except BOMCycleError as e:
+        messages.warning(request, str(e))
+        return HttpResponseRedirect(reverse('list_mo'))
+    if request.GET.get('format'):
+        header, rows = mo_export(parts, products)
+        return export_response(request.GET['format'], 'MO-%s' % mo.number, header, rows)
     #used to add parts to a Purchase Order
     if request.method == "POST":
         if "addPO" in request.POST:
-            #get all checked parts
-            checkedlist = request.POST.getlist("checkedbox")
-            po_partlist = {}
-            for part in checkedlist:
-                #strip of engimusing part number
-                number = part.split("-",1)[0].strip()
-                #strip part description
-                description = part.split("-",1)[1].strip()
-                if number and description:
-                    #get part from description and number
-                    part_obj = Part.objects.filter(description=description, engimusingPartNumber=number).first()
-                    #add part and quantity needed to dictionary
-                    po_partlist[part_obj] = parts[part_obj]
-                else:
-                    messages.warning(request, ('Part must have an engimusing part number and description to be added.'))
-                    url = reverse('detail_mo')
-                    return HttpResponseRedirect(url)
-            #pass dictionary of selected parts to save a Purchase Order object
-            po_id = generate_po_from_mo(po_partlist)
-            return HttpResponseRedirect(reverse('edit_po', args=[po_id]))
+            #checked parts by id, ordered with the amount still needed
+            checked = set(request.POST.getlist("checkedbox"))
+            quantities = {part.id: value.net for part, value in parts.items()
+                          if str(part.id) in checked}
+            if not quantities:
+                messages.warning(request, ('Select the parts to add to a purchase order.'))
+                return HttpResponseRedirect(reverse('detail_mo', args=[mo.id]))
+            return redirect_to_purchase_orders(request, generate_purchase_orders(quantities))
     return render(request, 'mo_detail.html', {'parts': parts, 'products': products,
                                               'mo': mo})
 
-def generate_po_from_mo(partList):
-    #create purchase order, PO number will be assigned
-    po = PurchaseOrder.objects.create()
-    #assign all parts from parts dictionary to the purchase order
-    for key, value in partList.items():
-        PurchaseOrderParts.objects.create(purchase_order=po, part=key, quantity=value[1])
-    return po.id   
-
+#combined requirements of all open manufacturing orders from the last mrp run
+def mrp_plan_view(request):
+    if request.method == 'POST' and 'poBtn' in request.POST:
+        #order every part that's short from its preferred vendor
+        try:
+            purchase_orders = order_shortages()
+        except BOMCycleError as e:
+            messages.warning(request, str(e))
+            return HttpResponseRedirect(reverse('mrp_plan'))
+        if not purchase_orders:
+            messages.warning(request, 'No parts need to be ordered.')
+            return HttpResponseRedirect(reverse('mrp_plan'))
+        return redirect_to_purchase_orders(request, purchase_orders)
+    if request.method == 'POST':
+        try:
+            saved = run_mrp(full='fullBtn' in request.POST)
+            messages.success(request, 'MRP run complete, %d requirements updated.' % saved)
+        except BOMCycleError as e:
+            messages.warning(request, str(e))
+        return HttpResponseRedirect(reverse('mrp_plan'))
+    planned = PlannedRequirement.objects.select_related('part', 'product')
+    parts = planned.filter(part__isnull=False).order_by('-net', 'part__engimusingPartNumber')
+    products = planned.filter(product__isnull=False).order_by('-net', 'product__description')
+    pending = PlanningChange.objects.exists()
+    return render(request, 'mrp_plan.html', {'parts': parts, 'products': products,
+                                             'pending': pending})
+
+def redirect_to_purchase_orders(request, purchase_orders):
+    #straight to the order if only one was made, otherwise to the list of orders
+    if len(purchase_orders) == 1:
+        return HttpResponseRedirect(reverse('edit_po', args=[purchase_orders[0].id]))
+    messages.success(request, 'Created purchase orders ' +
+                     ', '.join(po.number for po in purchase_orders) + '.')
+    return HttpResponseRedirect(reverse('list_po'))
+
+#lines of every purchase order, or only the one given by ?id=, as csv or xlsx
+def export_purchase_orders(request):
+    purchase_orders = PurchaseOrder.objects.all()
+    if request.GET.get('id'):
+        #one order, the whole list if no id is given
+        po_id = request.GET['id']
+        if not po_id.isdecimal():
+            raise Http404('No purchase order with id %s.' % po_id)
+        purchase_orders = purchase_orders.filter(id=po_id)
+    header, rows = purchase_order_export(purchase_orders)
+    return export_response(request.GET.get('format'), 'purchase-orders', header, rows)
 
 def po_list_view(request):
     purchase_orders = PurchaseOrder.objects.all()
     if request.method == 'POST':
         #used to filter POs by part or vendor
         search = request.POST["search"]
-        purchase_orders = purchase_orders.annotate(search=SearchVector('part__engimusingPartNumber',
-                                                                       'part__description',
-                                                                       'vendor__name')).filter(search=search)
-        #need this otherwise a purchase order may be listed several times
-        purchase_orders = purchase_orders.distinct('number')
+        query = SearchQuery(search)
+        #grouping by purchase order keeps it from being listed once per matching part
+        purchase_orders = (purchase_orders.filter(Q(part__search_vector=query) | Q(vendor__name__icontains=search))
+                           .annotate(rank=Max(SearchRank(F('part__search_vector'), query)))
+                           .order_by(F('rank').desc(nulls_last=True), 'number'))
     return render(request, 'purchase_order_list.html',
                   {'purchase_orders': purchase_orders})
     
@@ -1027,7 +928,8 @@ def print_tokens_digi(request):
     digi = DigiKeyAPI.objects.get(name="DigiKey")
     access = digi.access_token
     refresh = digi.refresh_token
-    return render(request, 'print_tokens.html', {'access':access, 'refresh':refresh})
+    return render(request, 'print_tokens.html', {'access':access, 'refresh':refresh,
+                                                 'stats': lookup_cache_stats()})
 
 #form to enter correct access tokens 
 def enter_tokens(request):
@@ -1039,6 +941,8 @@ def enter_tokens(request):
             digi = DigiKeyAPI.objects.get(name="DigiKey")
             setattr(digi,"access_token",access)
             setattr(digi,"refresh_token",refresh)
+            #expiry of the entered token isn't known, it's refreshed on the next lookup
+            digi.expires = None
             digi.save()
             return HttpResponseRedirect(reverse('list_types'))
     else: